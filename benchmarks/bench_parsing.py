@@ -0,0 +1,96 @@
+"""Compare the legacy full-tree html.parser extraction with the strained extractor path.
+
+The fixture pages are synthetic listings mimicking the live markup, not
+captures of the sites (see bench_pipeline.py).
+
+Run from the repository root:
+
+    python benchmarks/bench_parsing.py [iterations]
+"""
+import os
+import sys
+import time
+
+from bs4 import BeautifulSoup
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import news_bot  # noqa: E402
+
+FIXTURES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures")
+
+FIXTURES = [
+    ("https://boursenews.ma/articles/actualite", "boursenews_actualite.html"),
+    ("https://boursenews.ma/articles/marches", "boursenews_marches.html"),
+    ("https://medias24.com/categorie/leboursier/actus/", "medias24_leboursier_actus.html"),
+]
+
+LEGACY_MEDIAS24_SELECTORS = [
+    "article h3", "article h2", "div.article h3", "div.article h2",
+    ".post-title h3", ".post-title h2", ".entry-title",
+    ".article-title", "h3", "h2", "h1"
+]
+
+
+def legacy_extract_headlines(base_url, html):
+    """The original extraction: full html.parser tree, selectors retried from scratch on every page"""
+    soup = BeautifulSoup(html, "html.parser")
+    if "medias24.com" not in base_url:
+        return [(h3, h3.get_text(strip=True)) for h3 in soup.find_all("h3")]
+    for selector in LEGACY_MEDIAS24_SELECTORS:
+        elements = soup.select(selector)
+        valid = []
+        for element in elements:
+            text = element.get_text(strip=True)
+            if text and "chargement" not in text.lower() and len(text) > 10:
+                valid.append((element, text))
+        if valid:
+            return valid
+    return []
+
+
+def load_fixtures():
+    pages = []
+    for base_url, name in FIXTURES:
+        with open(os.path.join(FIXTURES_DIR, name), encoding="utf-8") as f:
+            pages.append((base_url, f.read()))
+    return pages
+
+
+def run(extract, pages, iterations):
+    start = time.perf_counter()
+    found = 0
+    for _ in range(iterations):
+        for base_url, html in pages:
+            found += len(extract(base_url, html))
+    return time.perf_counter() - start, found // iterations
+
+
+def main():
+    iterations = int(sys.argv[1]) if len(sys.argv) > 1 else 20
+    pages = load_fixtures()
+    total_kb = sum(len(html.encode("utf-8")) for _, html in pages) / 1024
+
+    # The new path prints its selector choice for medias24; keep the benchmark output readable
+    quiet = open(os.devnull, "w")
+    real_stdout = sys.stdout
+
+    print(f"📄 {len(pages)} fixtures, {total_kb:.0f} KB, {iterations} iterations, parser: {news_bot.HTML_PARSER}")
+    legacy_time, legacy_found = run(legacy_extract_headlines, pages, iterations)
+    sys.stdout = quiet
+    try:
+        new_time, new_found = run(news_bot.extract_headlines, pages, iterations)
+    finally:
+        sys.stdout = real_stdout
+        quiet.close()
+
+    per_page = iterations * len(pages)
+    print(f"🐢 legacy   : {legacy_time:.3f}s ({legacy_time / per_page * 1000:.2f} ms/page, {legacy_found} headlines)")
+    print(f"⚡ extractor: {new_time:.3f}s ({new_time / per_page * 1000:.2f} ms/page, {new_found} headlines)")
+    print(f"📈 speedup  : x{legacy_time / new_time:.1f}")
+    if legacy_found != new_found:
+        print("⚠️  Headline counts differ between the two paths")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,324 @@
+"""Replay the fixture pages through the whole pipeline, offline.
+
+The fixtures are synthetic: generated HTML and RSS that mimic the markup of
+the BourseNews and Medias24 listings (selectors, date formats, dates inside
+the listing), padded with scripts and sidebars to the weight of a real page.
+They are not captures of the live sites, so they measure throughput and pin
+article counts; they do not prove that the extractors still match production.
+
+One local HTTP server stands in for the news sites, Gemini and Telegram, so
+every stage (fetch, parse, keyword matching, dedup, summarization, message
+formatting, delivery and the end-to-end scrape) runs against the same inputs
+every time. Throughput is compared with a saved baseline; article counts must
+match it exactly.
+
+Run from the repository root:
+
+    python benchmarks/bench_pipeline.py [--iterations N] [--baseline benchmarks/baseline.json]
+                                        [--save-baseline] [--max-regression 0.25]
+"""
+import argparse
+import contextlib
+import io
+import json
+import os
+import re
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+FIXTURES_DIR = os.path.join(BENCH_DIR, "fixtures")
+DEFAULT_BASELINE = os.path.join(BENCH_DIR, "baseline.json")
+
+# Live URL -> synthetic fixture served in its place
+FIXTURES = {
+    "https://boursenews.ma/articles/actualite": "boursenews_actualite.html",
+    "https://boursenews.ma/articles/marches": "boursenews_marches.html",
+    "https://medias24.com/categorie/leboursier/actus/": "medias24_leboursier_actus.html",
+    "https://medias24.com/categorie/leboursier/actus/feed/": "medias24_leboursier_actus_feed.xml",
+}
+
+# Replay clock: the morning the fixture articles are dated
+REPLAY_NOW = datetime(2025, 3, 5, 10)
+
+_PROMPT_ARTICLE_RE = re.compile(r"^id=(\d+)\. (.+)$", re.MULTILINE)
+
+
+def fixture_route(url):
+    """Path under which the local server serves a live URL: /<host><path>"""
+    parsed = urlparse(url)
+    return f"/{parsed.netloc}{parsed.path}"
+
+
+class FakeUpstreamHandler(BaseHTTPRequestHandler):
+    """News sites on GET, Gemini and Telegram on POST"""
+
+    routes = {}
+    telegram_messages = 0
+    telegram_lock = threading.Lock()
+
+    def do_GET(self):
+        fixture = self.routes.get(self.path)
+        if fixture is None:
+            self.send_error(404)
+            return
+        content_type = "application/rss+xml" if fixture.endswith(".xml") else "text/html"
+        with open(os.path.join(FIXTURES_DIR, fixture), "rb") as f:
+            self.reply(f.read(), f"{content_type}; charset=utf-8")
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        if self.path.startswith("/gemini"):
+            self.reply_gemini(json.loads(body))
+        elif self.path.endswith("/sendMessage"):
+            with self.telegram_lock:
+                FakeUpstreamHandler.telegram_messages += 1
+            self.reply(json.dumps({"ok": True, "result": {}}).encode(), "application/json")
+        else:
+            self.send_error(404)
+
+    def reply_gemini(self, request):
+        """Answer every article of the prompt, the way the structured output would"""
+        prompt = request["contents"][0]["parts"][0]["text"]
+        items = [
+            {
+                "id": int(article_id),
+                "merged_ids": [],
+                "title": title[:50],
+                "summary": f"ملخص تجريبي للمقال {article_id} حول تأثيره على السوق",
+                "importance": 2,
+            }
+            for article_id, title in _PROMPT_ARTICLE_RE.findall(prompt)
+        ]
+        text = json.dumps(items, ensure_ascii=False)
+        answer = {
+            "candidates": [{"content": {"parts": [{"text": text}]}}],
+            "usageMetadata": {
+                "promptTokenCount": len(prompt) // 4,
+                "candidatesTokenCount": len(text) // 4,
+                "totalTokenCount": (len(prompt) + len(text)) // 4,
+            },
+        }
+        self.reply(json.dumps(answer, ensure_ascii=False).encode("utf-8"), "application/json")
+
+    def reply(self, body, content_type):
+        self.send_response(200)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_fake_upstream():
+    FakeUpstreamHandler.routes = {fixture_route(url): name for url, name in FIXTURES.items()}
+    server = ThreadingHTTPServer(("127.0.0.1", 0), FakeUpstreamHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_address[1]}"
+
+
+def configure_environment(base_url, state_dir):
+    """Point the bot at the local server; must run before news_bot is imported"""
+    os.environ.update({
+        "STATE_DB_PATH": os.path.join(state_dir, "bench_state.db"),
+        "RUN_REPORT_PATH": "",
+        "HTTP_CACHE_ENABLED": "0",
+        "GEMINI_API_URL": f"{base_url}/gemini",
+        "GEMINI_API_KEY": "bench",
+        "TELEGRAM_API_URL": base_url,
+        "BOT_TOKEN": "bench",
+        "CHAT_ID": "1",
+        "TELEGRAM_GLOBAL_RATE": "1000000",
+        "TELEGRAM_PER_CHAT_INTERVAL": "0",
+    })
+
+
+def local_sources(news_bot, base_url):
+    """Copies of the registered sources whose listings and feeds live on the local server"""
+    def local(url):
+        return base_url + fixture_route(url)
+
+    return [
+        news_bot.Source(
+            name=source.name,
+            host=source.host,  # Keeps article links identical to production
+            listing_urls=[local(url) for url in source.listing_urls],
+            extractor=source.extractor,
+            pagination=source.pagination,
+            feeds={local(url): local(feed) for url, feed in source.feeds.items()},
+            max_pages=1,  # Only the first page of every listing has a fixture
+            max_concurrency=source.max_concurrency,
+            timeout=source.timeout,
+        )
+        for source in news_bot.SOURCES.values()
+    ]
+
+
+def timed(iterations, func):
+    """Average seconds per call of func over iterations, and its last result"""
+    start = time.perf_counter()
+    for _ in range(iterations):
+        result = func()
+    return (time.perf_counter() - start) / iterations, result
+
+
+def reset_state(news_bot):
+    db = news_bot.get_state_db()
+    with news_bot._state_db_lock:
+        for table in ("seen_articles", "summary_cache"):
+            db.execute(f"DELETE FROM {table}")
+        db.commit()
+    news_bot._pending_http_cache.clear()
+
+
+def run_stages(news_bot, sources, iterations):
+    """Time every stage; returns {stage: {'seconds', 'units': {unit: count}[, 'counts': {...}]}}
+
+    Throughput is reported per unit; counts are only checked against the baseline.
+    """
+    stages = {}
+
+    # Every fixture page, feed and HTML alike
+    jobs = [
+        (source, base_url, page)
+        for source in sources
+        for base_url in source.listing_urls
+        for page in ([news_bot.FEED_PAGE] if base_url in source.feeds else []) + [1]
+    ]
+    seconds, results = timed(iterations, lambda: news_bot.fetch_listing_pages(jobs))
+    failed = [r['url'] for r in results if r['error']]
+    if failed:
+        raise RuntimeError(f"Fixture fetch failed: {failed}")
+    stages['fetch'] = {'seconds': seconds, 'units': {'pages': len(results)}}
+
+    def parse_all():
+        articles = []
+        for (source, base_url, page), result in zip(jobs, results):
+            parse = news_bot.parse_feed if page == news_bot.FEED_PAGE else news_bot.parse_listing_page
+            articles.extend(parse(source, base_url, result['response'].content, REPLAY_NOW))
+        return articles
+    seconds, articles = timed(iterations, parse_all)
+    stages['parse'] = {'seconds': seconds, 'units': {'pages': len(results), 'articles': len(articles)}}
+
+    headlines = [
+        text
+        for (source, _, page), result in zip(jobs, results) if page != news_bot.FEED_PAGE
+        for _, text in news_bot.extract_headlines(source, result['response'].content)
+    ]
+    seconds, _ = timed(iterations, lambda: [news_bot.match_keywords(text) for text in headlines])
+    stages['keywords'] = {'seconds': seconds, 'units': {'headlines': len(headlines)}}
+
+    seconds, clusters = timed(iterations, lambda: news_bot.cluster_articles(articles))
+    stages['dedup'] = {'seconds': seconds, 'units': {'articles': len(articles)}, 'counts': {'clusters': len(clusters)}}
+
+    def summarize():
+        reset_state(news_bot)  # Every iteration goes through the model, not the cache
+        return news_bot.build_digest(articles)
+    seconds, (_, _, deliveries) = timed(iterations, summarize)
+    digest = deliveries[news_bot.CHAT_IDS[0]][0]
+    stages['summarize'] = {'seconds': seconds, 'units': {'articles': len(articles)}}
+
+    seconds, messages = timed(iterations, lambda: news_bot.split_telegram_message(digest))
+    stages['format'] = {'seconds': seconds, 'units': {'messages': len(messages)}, 'counts': {'chars': len(digest)}}
+
+    FakeUpstreamHandler.telegram_messages = 0
+    seconds, delivered = timed(iterations, lambda: news_bot.send_to_telegram(digest))
+    if not delivered or FakeUpstreamHandler.telegram_messages != iterations * len(messages):
+        raise RuntimeError("Delivery to the fake Telegram server failed")
+    stages['deliver'] = {'seconds': seconds, 'units': {'messages': len(messages)}}
+
+    def scrape():
+        reset_state(news_bot)  # Nothing seen yet: the run behaves like the first of the day
+        return news_bot.get_today_articles(sources, now=REPLAY_NOW)
+    seconds, scraped = timed(iterations, scrape)
+    stages['end_to_end'] = {'seconds': seconds, 'units': {'pages': len(news_bot._fetch_log), 'articles': len(scraped)}}
+
+    return stages
+
+
+def throughput(stage):
+    return {f"{unit}/s": count / stage['seconds'] for unit, count in stage['units'].items() if stage['seconds'] > 0}
+
+
+def compare(stages, baseline, max_regression):
+    """Print the comparison with the baseline; returns the list of failures"""
+    failures = []
+    for name, stage in stages.items():
+        base = baseline.get('stages', {}).get(name)
+        if base is None:
+            print(f"   {name:<11} (not in baseline)")
+            continue
+        counts, base_counts = {**stage['units'], **stage.get('counts', {})}, {**base['units'], **base.get('counts', {})}
+        if counts != base_counts:
+            failures.append(f"{name}: counts {counts} != baseline {base_counts}")
+        for metric, value in throughput(stage).items():
+            reference = throughput(base).get(metric)
+            if not reference:
+                continue
+            ratio = value / reference
+            flag = ""
+            if max_regression is not None and ratio < 1 - max_regression:
+                flag = "  ⚠️  regression"
+                failures.append(f"{name}: {metric} x{ratio:.2f} of baseline")
+            print(f"   {name:<11} {metric:<13} {value:>12.1f} vs {reference:>12.1f}  x{ratio:.2f}{flag}")
+    return failures
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--iterations", type=int, default=5)
+    parser.add_argument("--baseline", default=DEFAULT_BASELINE)
+    parser.add_argument("--save-baseline", action="store_true", help="overwrite the baseline with this run")
+    parser.add_argument("--max-regression", type=float, default=None,
+                        help="fail when a throughput drops more than this fraction below the baseline")
+    args = parser.parse_args()
+
+    server, base_url = start_fake_upstream()
+    with tempfile.TemporaryDirectory() as state_dir:
+        configure_environment(base_url, state_dir)
+        sys.path.insert(0, os.path.dirname(BENCH_DIR))
+        import news_bot
+
+        sources = local_sources(news_bot, base_url)
+        # The bot narrates every article; keep the benchmark output readable
+        with contextlib.redirect_stdout(io.StringIO()):
+            stages = run_stages(news_bot, sources, args.iterations)
+        news_bot.get_state_db().close()
+    server.shutdown()
+
+    print(f"📦 {len(FIXTURES)} fixtures, {args.iterations} iterations, parser: {news_bot.HTML_PARSER}")
+    for name, stage in stages.items():
+        rates = ", ".join(f"{value:.1f} {metric}" for metric, value in throughput(stage).items())
+        print(f"⏱️  {name:<11} {stage['seconds'] * 1000:>9.2f} ms  {rates}")
+
+    report = {'iterations': args.iterations, 'parser': news_bot.HTML_PARSER, 'stages': stages}
+    if args.save_baseline:
+        with open(args.baseline, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+            f.write("\n")
+        print(f"💾 Baseline saved to {args.baseline}")
+        return
+
+    if not os.path.exists(args.baseline):
+        print(f"ℹ️  No baseline at {args.baseline} - run with --save-baseline to create one")
+        return
+
+    with open(args.baseline, encoding="utf-8") as f:
+        baseline = json.load(f)
+    print(f"\n📊 Against baseline {os.path.relpath(args.baseline)} (parser: {baseline.get('parser')})")
+    failures = compare(stages, baseline, args.max_regression)
+    if failures:
+        print("\n❌ " + "\n❌ ".join(failures))
+        sys.exit(1)
+    print("\n✅ No regression")
+
+
+if __name__ == "__main__":
+    main()
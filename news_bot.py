@@ -1,9 +1,26 @@
 import requests
-from bs4 import BeautifulSoup
-from datetime import datetime, timedelta
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from bs4 import BeautifulSoup, SoupStrainer
+from datetime import datetime, timedelta, timezone, time as dtime
+from email.utils import parsedate_to_datetime
+from xml.etree import ElementTree
+from zoneinfo import ZoneInfo
+import argparse
+import csv
+import hashlib
+import html
+import json
 import os
 import re
+import sqlite3
+import threading
 import time
+import unicodedata
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, urlencode, parse_qsl
 
 # Try to import cloudscraper for medias24.com access
 try:
@@ -12,16 +29,319 @@ try:
 except ImportError:
     CLOUDSCRAPER_AVAILABLE = False
 
+# lxml is much faster than the pure-python parser; fall back when it is not installed
+try:
+    import lxml  # noqa: F401
+    LXML_AVAILABLE = True
+except ImportError:
+    LXML_AVAILABLE = False
+
+HTML_PARSER = "lxml" if LXML_AVAILABLE else "html.parser"
+
+# Only headline containers and links are built into the tree, scripts, menus and sidebars are skipped.
+# Containers are also kept by class, for selectors such as "div.article h3" or ".entry-title"
+HEADLINE_TAGS = {"article", "h1", "h2", "h3", "a"}
+HEADLINE_CONTAINER_CLASSES = {"article", "post-title", "entry-title", "article-title"}
+
+def _is_headline_markup(name, attrs=None):
+    if name in HEADLINE_TAGS:
+        return True
+    classes = (attrs or {}).get("class") or []
+    if isinstance(classes, str):
+        classes = classes.split()
+    return any(cls in HEADLINE_CONTAINER_CLASSES for cls in classes)
+
+class _HeadlineStrainer(SoupStrainer):
+    """Older bs4 hands (name, attrs) to the callable; bs4 >= 4.13 asks allow_tag_creation"""
+
+    def __init__(self):
+        super().__init__(_is_headline_markup)
+
+    def allow_tag_creation(self, nsprefix, name, attrs):
+        return _is_headline_markup(name, attrs)
+
+HEADLINE_STRAINER = _HeadlineStrainer()
+
 BOT_TOKEN = os.getenv("BOT_TOKEN")
 CHAT_ID = os.getenv("CHAT_ID")
+# Several channels can be served with a comma-separated CHAT_ID
+CHAT_IDS = [chat_id.strip() for chat_id in (CHAT_ID or "").split(",") if chat_id.strip()]
 GEMINI_API_KEY = os.getenv("GEMINI_API_KEY")
 
+# Fetch engine: all listing pages are requested in parallel, bounded per host
+MAX_FETCH_WORKERS = int(os.getenv("MAX_FETCH_WORKERS", "8"))
+PER_HOST_CONCURRENCY = int(os.getenv("PER_HOST_CONCURRENCY", "2"))
+LISTING_PAGES = 2  # Check first 2 pages of every listing
+
+# Optional second stage: download the pages of the selected articles for richer scoring and summaries
+FETCH_ARTICLE_BODIES = os.getenv("FETCH_ARTICLE_BODIES", "0") == "1"
+ARTICLE_FETCH_WORKERS = int(os.getenv("ARTICLE_FETCH_WORKERS", "4"))
+ARTICLE_BODY_MAX_CHARS = int(os.getenv("ARTICLE_BODY_MAX_CHARS", "800"))  # Kept per article, also sent to Gemini
+ARTICLE_BODY_TTL_DAYS = int(os.getenv("ARTICLE_BODY_TTL_DAYS", "7"))
+ARTICLE_MAX_FIGURES = 6
+ARTICLE_MIN_PARAGRAPH_LENGTH = 40  # Shorter paragraphs are captions, bylines and share buttons
+
+# Only paragraphs (and the article container holding them) are built into the tree
+ARTICLE_BODY_STRAINER = SoupStrainer(["article", "p"])
+
+# Amounts, percentages and index points quoted in an article
+_FIGURE_RE = re.compile(
+    r"[+-]?\d+(?:[ \u00a0\u202f.,]\d+)*\s*"
+    r"(?:%|MMDH|MDH|Mrds? de DH|milliards? de dirhams|millions? de dirhams|DH|dirhams|points?|pts)(?!\w)",
+    re.IGNORECASE,
+)
+
+# Sources with an RSS feed are read from it first; their HTML listing pages are only fetched when the feed fails
+FEED_PAGE = "feed"
+ARTICLE_PAGE = "article"  # Page marker of article body downloads in fetch records
+
+# Next allowed request time per host, enforcing each source's politeness delay
+_host_next_slot = {}
+_host_next_slot_lock = threading.Lock()
+
+_host_semaphores = {}
+_host_semaphores_lock = threading.Lock()
+
+# Session layer: one pooled keep-alive session per host, one shared cloudscraper
+HTTP_POOL_CONNECTIONS = int(os.getenv("HTTP_POOL_CONNECTIONS", "4"))
+HTTP_POOL_MAXSIZE = int(os.getenv("HTTP_POOL_MAXSIZE", "8"))
+HTTP_MAX_RETRIES = int(os.getenv("HTTP_MAX_RETRIES", "2"))
+HTTP_BACKOFF_FACTOR = float(os.getenv("HTTP_BACKOFF_FACTOR", "0.5"))
+
+_sessions = {}
+_sessions_lock = threading.Lock()
+_scraper = None
+
+# Persistent bot state (seen articles, ...) lives in one SQLite file
+STATE_DB_PATH = os.getenv("STATE_DB_PATH", "bot_state.db")
+SEEN_TTL_DAYS = int(os.getenv("SEEN_TTL_DAYS", "7"))
+HTTP_CACHE_ENABLED = os.getenv("HTTP_CACHE_ENABLED", "1") == "1"
+
+# Per-article Gemini summaries; bump SUMMARY_PROMPT_VERSION whenever the prompt changes
+SUMMARY_PROMPT_VERSION = 3
+SUMMARY_CACHE_TTL_DAYS = int(os.getenv("SUMMARY_CACHE_TTL_DAYS", "7"))
+SUMMARY_CACHE_MAX_ENTRIES = int(os.getenv("SUMMARY_CACHE_MAX_ENTRIES", "2000"))
+
+# Gemini scheduler: articles are split into token-budgeted chunks summarized concurrently
+GEMINI_CHUNK_TOKEN_BUDGET = int(os.getenv("GEMINI_CHUNK_TOKEN_BUDGET", "1500"))
+GEMINI_ARTICLE_OUTPUT_TOKENS = 120  # Expected answer size per article, counted in the budget
+GEMINI_MAX_CHUNK_ARTICLES = int(os.getenv("GEMINI_MAX_CHUNK_ARTICLES", "8"))
+GEMINI_MAX_CONCURRENCY = int(os.getenv("GEMINI_MAX_CONCURRENCY", "3"))
+GEMINI_MAX_RETRIES = int(os.getenv("GEMINI_MAX_RETRIES", "3"))
+GEMINI_BACKOFF_SECONDS = float(os.getenv("GEMINI_BACKOFF_SECONDS", "2"))
+GEMINI_TIMEOUT = 30
+GEMINI_API_URL = os.getenv(
+    "GEMINI_API_URL", "https://generativelanguage.googleapis.com/v1beta/models/gemini-1.5-flash:generateContent"
+)
+
+# Telegram delivery: messages are split to the API limit and sent through rate-limited per-chat queues
+TELEGRAM_API_URL = os.getenv("TELEGRAM_API_URL", "https://api.telegram.org")
+TELEGRAM_MESSAGE_LIMIT = 4096
+TELEGRAM_GLOBAL_RATE = float(os.getenv("TELEGRAM_GLOBAL_RATE", "25"))  # Messages per second, all chats
+TELEGRAM_PER_CHAT_INTERVAL = float(os.getenv("TELEGRAM_PER_CHAT_INTERVAL", "1.0"))  # Seconds between messages to one chat
+TELEGRAM_MAX_RETRIES = 3
+TELEGRAM_MAX_CONCURRENT_CHATS = int(os.getenv("TELEGRAM_MAX_CONCURRENT_CHATS", "8"))
+
+_MARKDOWN_LINK_RE = re.compile(r"\[([^\]]+)\]\(([^)\s]+)\)")
+_MARKDOWN_BOLD_RE = re.compile(r"\*\*(.+?)\*\*")
+_MARKDOWN_SINGLE_BOLD_RE = re.compile(r"(?<![*\w])\*([^*\n]+)\*(?![*\w])")
+_LINK_PLACEHOLDER_RE = re.compile(r"\x00(\d+)\x00")
+
+# Daemon mode: adaptive polling around the Casablanca session, instant alerts for level-3 news
+MARKET_TIMEZONE = ZoneInfo("Africa/Casablanca")
+MARKET_OPEN = dtime(9, 30)
+MARKET_CLOSE = dtime(15, 30)
+MARKET_POLL_SECONDS = int(os.getenv("MARKET_POLL_SECONDS", "300"))
+OFF_HOURS_POLL_SECONDS = int(os.getenv("OFF_HOURS_POLL_SECONDS", "1800"))
+DIGEST_TIME = dtime.fromisoformat(os.getenv("DIGEST_TIME", "08:00"))  # Local time of the daily digest
+DIGEST_RETRY_SECONDS = int(os.getenv("DIGEST_RETRY_SECONDS", "60"))  # First retry of a failed digest, then doubled
+ALERT_IMPORTANCE_LEVEL = 3
+
+# Instrumentation: per-stage counters and timings, dumped as a JSON run report
+# and served in Prometheus text format in daemon mode when METRICS_PORT is set
+RUN_REPORT_PATH = os.getenv("RUN_REPORT_PATH", "run_report.json")
+METRICS_PORT = int(os.getenv("METRICS_PORT", "0"))
+METRICS_PREFIX = "newsbot"
+
+_metrics_lock = threading.Lock()
+_metric_counters = {}  # (name, labels) -> total
+_metric_timings = {}  # (name, labels) -> [count, total seconds, max seconds]
+_fetch_log = []  # One record per page requested in the current run
+_metrics_started_at = time.time()
+
+# Structured answer requested from Gemini, one object per summary
+GEMINI_SUMMARY_SCHEMA = {
+    "type": "ARRAY",
+    "items": {
+        "type": "OBJECT",
+        "properties": {
+            "id": {"type": "INTEGER"},
+            "merged_ids": {"type": "ARRAY", "items": {"type": "INTEGER"}},
+            "title": {"type": "STRING"},
+            "summary": {"type": "STRING"},
+            "importance": {"type": "INTEGER"},
+        },
+        "required": ["id", "title", "summary"],
+    },
+}
+
+STATE_SCHEMA = [
+    """CREATE TABLE IF NOT EXISTS seen_articles (
+        url TEXT PRIMARY KEY,
+        title_hash TEXT NOT NULL,
+        seen_at REAL NOT NULL
+    )""",
+    "CREATE INDEX IF NOT EXISTS idx_seen_articles_title_hash ON seen_articles (title_hash)",
+    "CREATE INDEX IF NOT EXISTS idx_seen_articles_seen_at ON seen_articles (seen_at)",
+    """CREATE TABLE IF NOT EXISTS http_cache (
+        url TEXT PRIMARY KEY,
+        etag TEXT,
+        last_modified TEXT,
+        body_hash TEXT NOT NULL,
+        fetched_at REAL NOT NULL
+    )""",
+    """CREATE TABLE IF NOT EXISTS summary_cache (
+        cache_key TEXT PRIMARY KEY,
+        entry TEXT NOT NULL,
+        created_at REAL NOT NULL
+    )""",
+    "CREATE INDEX IF NOT EXISTS idx_summary_cache_created_at ON summary_cache (created_at)",
+    """CREATE TABLE IF NOT EXISTS subscriptions (
+        chat_id TEXT NOT NULL,
+        kind TEXT NOT NULL,
+        value TEXT NOT NULL,
+        min_importance INTEGER NOT NULL DEFAULT 1,
+        created_at REAL NOT NULL,
+        PRIMARY KEY (chat_id, kind, value)
+    )""",
+    """CREATE TABLE IF NOT EXISTS articles_archive (
+        id INTEGER PRIMARY KEY,
+        url TEXT NOT NULL UNIQUE,
+        title TEXT NOT NULL,
+        link TEXT NOT NULL,
+        source TEXT NOT NULL,
+        section TEXT,
+        importance INTEGER NOT NULL,
+        match_reason TEXT,
+        tickers TEXT NOT NULL,
+        keywords TEXT NOT NULL,
+        summary TEXT,
+        published TEXT NOT NULL,
+        archived_at REAL NOT NULL
+    )""",
+    "CREATE INDEX IF NOT EXISTS idx_articles_archive_published ON articles_archive (published)",
+    """CREATE TABLE IF NOT EXISTS archive_daily_counts (
+        day TEXT NOT NULL,
+        ticker TEXT NOT NULL,
+        importance INTEGER NOT NULL,
+        articles INTEGER NOT NULL,
+        PRIMARY KEY (day, ticker, importance)
+    )""",
+    """CREATE TABLE IF NOT EXISTS article_bodies (
+        url TEXT PRIMARY KEY,
+        body TEXT NOT NULL,
+        figures TEXT NOT NULL,
+        fetched_at REAL NOT NULL
+    )""",
+    """CREATE TABLE IF NOT EXISTS pending_digest (
+        url TEXT PRIMARY KEY,
+        article TEXT NOT NULL,
+        queued_at REAL NOT NULL
+    )""",
+]
+
+# Full-text index over the archive, kept in sync by triggers; skipped when SQLite lacks FTS5
+ARCHIVE_FTS_SCHEMA = [
+    """CREATE VIRTUAL TABLE IF NOT EXISTS articles_fts USING fts5(
+        title, summary, tickers, content='articles_archive', content_rowid='id',
+        tokenize='unicode61 remove_diacritics 2'
+    )""",
+    """CREATE TRIGGER IF NOT EXISTS articles_archive_ai AFTER INSERT ON articles_archive BEGIN
+        INSERT INTO articles_fts (rowid, title, summary, tickers) VALUES (new.id, new.title, new.summary, new.tickers);
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS articles_archive_ad AFTER DELETE ON articles_archive BEGIN
+        INSERT INTO articles_fts (articles_fts, rowid, title, summary, tickers)
+        VALUES ('delete', old.id, old.title, old.summary, old.tickers);
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS articles_archive_au AFTER UPDATE ON articles_archive BEGIN
+        INSERT INTO articles_fts (articles_fts, rowid, title, summary, tickers)
+        VALUES ('delete', old.id, old.title, old.summary, old.tickers);
+        INSERT INTO articles_fts (rowid, title, summary, tickers) VALUES (new.id, new.title, new.summary, new.tickers);
+    END""",
+]
+
+# Every delivered article is archived with its summary for history queries
+ARCHIVE_ENABLED = os.getenv("ARCHIVE_ENABLED", "1") == "1"
+
+_state_db = None
+_state_db_lock = threading.RLock()
+_archive_fts_available = False
+_pending_http_cache = []  # Validators of parsed pages, committed once the run is delivered
+
+# Subscribers follow a ticker, a keyword or everything ('all'), above a minimum importance;
+# routing goes through an in-memory inverted index {(kind, value): {chat_id: min_importance}},
+# rebuilt whenever another connection (the subscribe CLI) has written to the state database
+_subscription_index = None
+_subscription_index_version = None
+_subscription_index_lock = threading.Lock()
+
+BROWSER_HEADERS = {
+    'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36',
+    'Accept': 'text/html,application/xhtml+xml,application/xml;q=0.9,image/webp,*/*;q=0.8',
+    'Accept-Language': 'fr-FR,fr;q=0.9,en;q=0.8',
+    'Accept-Encoding': 'gzip, deflate, br',
+    'Connection': 'keep-alive',
+    'Upgrade-Insecure-Requests': '1',
+}
+
+# Alternative user agents used when a site blocks the default one
+USER_AGENTS = [
+    'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36',
+    'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/119.0.0.0 Safari/537.36',
+    'Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36'
+]
+
 french_months = {
     "01": "janvier", "02": "février", "03": "mars", "04": "avril",
     "05": "mai", "06": "juin", "07": "juillet", "08": "août",
     "09": "septembre", "10": "octobre", "11": "novembre", "12": "décembre"
 }
 
+# Month names (with and without accents) -> month number, for parse_french_datetime
+FRENCH_MONTH_NUMBERS = {name: int(number) for number, name in french_months.items()}
+FRENCH_MONTH_NUMBERS.update({"fevrier": 2, "aout": 8, "decembre": 12})
+
+RELATIVE_TIME_UNITS = {
+    "min": timedelta(minutes=1), "minute": timedelta(minutes=1),
+    "h": timedelta(hours=1), "heure": timedelta(hours=1),
+    "jour": timedelta(days=1), "semaine": timedelta(weeks=1),
+}
+
+# One compiled pass finds absolute, numeric and relative dates, with an optional time.
+# Every alternative is word-bounded: "cahier" or "fichier" must not read as "hier"
+_FRENCH_DATE_RE = re.compile(
+    r"(?<!\w)(?:(?P<day>\d{1,2})(?:er)?\s+(?P<month>" + "|".join(sorted(FRENCH_MONTH_NUMBERS, key=len, reverse=True)) + r")\s+(?P<year>\d{4})"
+    r"|(?P<nday>\d{1,2})/(?P<nmonth>\d{1,2})/(?P<nyear>\d{4})"
+    r"|il y a\s+(?P<amount>\d+|une?)\s*(?P<unit>minute|min|heure|h|jour|semaine)s?\b"
+    r"|(?P<relday>aujourd['’]hui|hier))(?!\w)"
+    r"(?:\s*(?:à|a|,|-)?\s*(?P<hour>\d{1,2})\s*[h:]\s*(?P<minute>\d{2}))?",
+    re.IGNORECASE,
+)
+
+# Articles older than this many hours are ignored
+FRESHNESS_HOURS = int(os.getenv("FRESHNESS_HOURS", "24"))
+
+# Near-duplicate clustering of headlines across sources (see cluster_articles)
+DEDUP_SIMILARITY = float(os.getenv("DEDUP_SIMILARITY", "0.5"))  # Character shingle Jaccard of two headlines
+DEDUP_WORD_SIMILARITY = float(os.getenv("DEDUP_WORD_SIMILARITY", "0.4"))  # Word Jaccard confirming a match
+MINHASH_BANDS = 16
+MINHASH_ROWS = 2
+_MINHASH_PRIME = (1 << 61) - 1
+_MINHASH_COEFFICIENTS = [
+    (1 + 2 * i * 0x9E3779B1 % _MINHASH_PRIME, 1 + i * 0x7F4A7C15 % _MINHASH_PRIME)
+    for i in range(MINHASH_BANDS * MINHASH_ROWS)
+]
+
 # STRICT keywords - only for direct Casablanca stock market relevance
 STRICT_STOCK_KEYWORDS = [
     "bourse de casablanca", "masi", "madex", "cotation", "introduction en bourse", 
@@ -30,17 +350,19 @@ STRICT_STOCK_KEYWORDS = [
     "société cotée", "indice boursier", "carnet d'ordres", "suspension", "reprise"
 ]
 
-# Listed companies on Casablanca Stock Exchange (major ones)
-LISTED_COMPANIES = [
-    "attijariwafa bank", "attijariwafa", "bank of africa", "boa", "bmce bank", "bmce",
-    "cih bank", "cih", "maroc telecom", "iam", "ocp group", "ocp", "managem",
-    "addoha", "lafargeholcim", "cosumar", "lesieur cristal", "bmci", "crédit du maroc",
-    "delta holding", "douja prom", "snep", "alliances", "aradei capital", "jet contractors",
-    "vicenne", "nexans maroc", "salafin", "wafa assurance", "atlanta", "rebab company",
-    "res dar saada", "marsa maroc", "sodep", "auto hall", "colorado", "disway",
-    "ennakl", "fenie brossette", "high tech payment systems", "involys", "label vie",
-    "microdata", "risma", "sonasid", "taqa morocco", "timar", "unimer"
-]
+# Listed companies on Casablanca Stock Exchange: canonical name, ticker, ISIN, sector and
+# every alias (accented, unaccented, Arabic) they are cited by, loaded on first use
+ENTITY_INDEX_PATH = os.getenv(
+    "ENTITY_INDEX_PATH", os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "listed_companies.json")
+)
+# ISINs come from the issuer list published by the Bourse de Casablanca (CSV export with
+# ticker and ISIN columns), matched on ticker; codes failing the ISIN check digit are ignored
+ISSUER_LIST_PATH = os.getenv(
+    "ISSUER_LIST_PATH", os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "issuers.csv")
+)
+
+_entity_index = None
+_entity_index_lock = threading.Lock()
 
 # High importance: IPOs, major corporate actions, index movements
 HIGH_IMPORTANCE_KEYWORDS = [
@@ -49,309 +371,1586 @@ HIGH_IMPORTANCE_KEYWORDS = [
     "rachat d'actions", "opa", "opv", "suspension de cotation"
 ]
 
-def get_today_articles():
-    now = datetime.now()
+# Medium importance: Company financial results, strategic moves
+MEDIUM_IMPORTANCE_KEYWORDS = [
+    "résultat", "chiffre d'affaires", "bénéfice", "stratégie", "partenariat", "investissement"
+]
+
+# Exclude general economic/international news
+EXCLUDE_KEYWORDS = [
+    "inflation", "pib", "croissance économique", "banque centrale", "politique monétaire",
+    "bourses européennes", "bourse américaine", "wall street", "euro stoxx", "s&p",
+    "onee", "oncf", "adm", "onda", "ram", "banque mondiale", "fmi"
+]
+
+# Every keyword list is compiled once into a single matcher (see match_keywords);
+# the 'company' category is filled with the aliases of the entity index
+KEYWORD_CATEGORIES = {
+    'exclude': EXCLUDE_KEYWORDS,
+    'stock': STRICT_STOCK_KEYWORDS,
+    'high': HIGH_IMPORTANCE_KEYWORDS,
+    'medium': MEDIUM_IMPORTANCE_KEYWORDS,
+}
+
+_keyword_matcher = None
+_keyword_matcher_lock = threading.Lock()
+
+def market_now():
+    """Current Casablanca wall-clock time, naive like every article date"""
+    return datetime.now(MARKET_TIMEZONE).replace(tzinfo=None)
+
+def parse_french_datetime(text, now=None):
+    """Find the French date or relative time of text, the first explicit date when there is one.
+
+    Handles "Mercredi 5 Mars 2025", "1er mars 2025 à 14h30", "05/03/2025 10:30",
+    "il y a 3 heures", "il y a 2h", "aujourd'hui" and "hier", all in Casablanca
+    time. Returns (datetime, has_time) or (None, False) when the text carries
+    no date.
+    """
+    now = now or market_now()
+    matches = list(_FRENCH_DATE_RE.finditer(text))
+    if not matches:
+        return None, False
+    # An explicit date beats a relative word appearing earlier in the text
+    match = next((m for m in matches if m.group('month') or m.group('nmonth')), matches[0])
     
-    # Generate date patterns for the last 24 hours only (today and yesterday)
-    date_patterns = []
-    for days_back in range(2):  # Today and yesterday only (last 24 hours)
-        target_date = now - timedelta(days=days_back)
-        day = str(target_date.day)
-        month = french_months[target_date.strftime("%m")]
-        year = str(target_date.year)
+    groups = match.groupdict()
+    try:
+        if groups['month']:
+            date = datetime(int(groups['year']), FRENCH_MONTH_NUMBERS[groups['month'].lower()], int(groups['day']))
+        elif groups['nmonth']:
+            date = datetime(int(groups['nyear']), int(groups['nmonth']), int(groups['nday']))
+        elif groups['unit']:
+            amount = 1 if groups['amount'].lower() in ("un", "une") else int(groups['amount'])
+            return now - amount * RELATIVE_TIME_UNITS[groups['unit'].lower()], True
+        else:
+            days_back = 1 if groups['relday'].lower() == "hier" else 0
+            date = (now - timedelta(days=days_back)).replace(hour=0, minute=0, second=0, microsecond=0)
         
-        # Add various date format patterns
-        date_patterns.extend([
-            f"{day} {month} {year}",
-            f"{day} {month.capitalize()} {year}",
-            f"Lundi {day} {month} {year}",
-            f"Mardi {day} {month} {year}",
-            f"Mercredi {day} {month} {year}",
-            f"Jeudi {day} {month} {year}",
-            f"Vendredi {day} {month} {year}",
-            f"Samedi {day} {month} {year}",
-            f"Dimanche {day} {month} {year}",
-            f"Lundi {day} {month.capitalize()} {year}",
-            f"Mardi {day} {month.capitalize()} {year}",
-            f"Mercredi {day} {month.capitalize()} {year}",
-            f"Jeudi {day} {month.capitalize()} {year}",
-            f"Vendredi {day} {month.capitalize()} {year}",
-            f"Samedi {day} {month.capitalize()} {year}",
-            f"Dimanche {day} {month.capitalize()} {year}",
-        ])
-
-    # Remove duplicates while preserving order
-    seen = set()
-    unique_patterns = []
-    for pattern in date_patterns:
-        if pattern not in seen:
-            seen.add(pattern)
-            unique_patterns.append(pattern)
-    
-    date_patterns = unique_patterns
-
-    urls = [
-        "https://boursenews.ma/articles/actualite",
-        "https://boursenews.ma/articles/marches",
-        "https://medias24.com/categorie/leboursier/actus/"
-    ]
+        if groups['hour']:
+            return date.replace(hour=int(groups['hour']), minute=int(groups['minute'])), True
+    except ValueError:
+        # Impossible dates such as "31 février"
+        return None, False
+    return date, False
+
+def is_fresh(published, has_time, now=None, hours=None):
+    """True when published falls inside the freshness window.
+
+    Dates without a time only know their day, so they are kept when that day
+    overlaps the window.
+    """
+    now = now or market_now()
+    cutoff = now - timedelta(hours=FRESHNESS_HOURS if hours is None else hours)
+    if has_time:
+        return published >= cutoff
+    return published.date() >= cutoff.date()
+
+def _http_retry(status_forcelist=(500, 502, 503, 504)):
+    """Retry/backoff policy shared by every client"""
+    return Retry(
+        total=HTTP_MAX_RETRIES,
+        backoff_factor=HTTP_BACKOFF_FACTOR,
+        status_forcelist=status_forcelist,
+        allowed_methods=frozenset(["GET", "HEAD"]),  # Never replay POSTs (Telegram would send twice)
+        raise_on_status=False,
+    )
+
+def _mount_pooled_adapter(session):
+    """Attach a pooled adapter with retry/backoff to both http and https"""
+    adapter = HTTPAdapter(pool_connections=HTTP_POOL_CONNECTIONS, pool_maxsize=HTTP_POOL_MAXSIZE, max_retries=_http_retry())
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+def _tune_scraper_adapters(scraper):
+    """Resize the pools and set retries of cloudscraper's own adapters.
+
+    Its https adapter carries the browser-like TLS cipher suite the Cloudflare
+    bypass relies on, so it is tuned in place instead of being replaced. 503 is
+    not retried: Cloudflare serves its challenge with it, and cloudscraper must
+    see that response to solve the challenge instead of urllib3 replaying it.
+    """
+    for adapter in set(scraper.adapters.values()):
+        adapter.max_retries = _http_retry(status_forcelist=(500, 502, 504))
+        adapter._pool_connections = HTTP_POOL_CONNECTIONS
+        adapter._pool_maxsize = HTTP_POOL_MAXSIZE
+        adapter.init_poolmanager(HTTP_POOL_CONNECTIONS, HTTP_POOL_MAXSIZE, block=adapter._pool_block)
+    return scraper
+
+def get_session(url):
+    """Return the shared keep-alive session for the host of url"""
+    host = urlparse(url).netloc
+    with _sessions_lock:
+        if host not in _sessions:
+            _sessions[host] = _mount_pooled_adapter(requests.Session())
+        return _sessions[host]
+
+def get_scraper():
+    """Return the shared cloudscraper instance so the Cloudflare challenge is solved once per run"""
+    global _scraper
+    with _sessions_lock:
+        if _scraper is None:
+            _scraper = _tune_scraper_adapters(cloudscraper.create_scraper())
+        return _scraper
+
+def _get_host_semaphore(host, limit=PER_HOST_CONCURRENCY):
+    """Return the semaphore bounding concurrent requests to one host"""
+    with _host_semaphores_lock:
+        if host not in _host_semaphores:
+            _host_semaphores[host] = threading.BoundedSemaphore(limit)
+        return _host_semaphores[host]
+
+def _wait_for_politeness_slot(host, delay):
+    """Sleep until host may be requested again, at most one request every `delay` seconds"""
+    if not delay:
+        return
+    with _host_next_slot_lock:
+        now = time.monotonic()
+        slot = max(now, _host_next_slot.get(host, now))
+        _host_next_slot[host] = slot + delay
+    if slot > now:
+        time.sleep(slot - now)
+
+def record_count(name, value=1, **labels):
+    """Add value to a counter, e.g. record_count("fetch_bytes", 1234, host="medias24.com")"""
+    key = (name, tuple(sorted(labels.items())))
+    with _metrics_lock:
+        _metric_counters[key] = _metric_counters.get(key, 0) + value
+
+def record_timing(name, seconds, **labels):
+    """Add one observed duration to a timing summary"""
+    key = (name, tuple(sorted(labels.items())))
+    with _metrics_lock:
+        timing = _metric_timings.setdefault(key, [0, 0.0, 0.0])
+        timing[0] += 1
+        timing[1] += seconds
+        timing[2] = max(timing[2], seconds)
+
+def _metric_label(labels):
+    return ",".join(f"{k}={v}" for k, v in labels) or "total"
+
+def build_run_report():
+    """Snapshot of every metric recorded since start, plus the pages fetched by the last run"""
+    with _metrics_lock:
+        counters = {}
+        for (name, labels), value in sorted(_metric_counters.items()):
+            counters.setdefault(name, {})[_metric_label(labels)] = value
+        timings = {}
+        for (name, labels), (count, total, longest) in sorted(_metric_timings.items()):
+            timings.setdefault(name, {})[_metric_label(labels)] = {
+                'count': count,
+                'total_s': round(total, 4),
+                'avg_s': round(total / count, 4),
+                'max_s': round(longest, 4),
+            }
+        fetches = list(_fetch_log)
     
-    # Improved headers to avoid being blocked, especially for medias24
-    user_agents = [
-        'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36',
-        'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/119.0.0.0 Safari/537.36',
-        'Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36'
-    ]
+    # Hit rates of the two caches, the figures that matter most for sizing
+    hit_rates = {}
+    for cache in ("http_cache", "summary_cache"):
+        hits = counters.get(cache, {}).get("result=hit", 0)
+        total = hits + counters.get(cache, {}).get("result=miss", 0)
+        hit_rates[cache] = round(hits / total, 3) if total else None
     
-    all_articles = []
-    print(f"🔍 Looking for STRICT Casablanca stock market & IPO articles from last 24 hours...")
-    print(f"📅 Date patterns: {len(date_patterns)} patterns for last 24 hours")
+    return {
+        'started_at': datetime.fromtimestamp(_metrics_started_at).isoformat(timespec="seconds"),
+        'generated_at': datetime.now().isoformat(timespec="seconds"),
+        'counters': counters,
+        'timings': timings,
+        'cache_hit_rates': hit_rates,
+        'fetches': fetches,
+    }
 
-    for base_url in urls:
-        print(f"\n📊 Checking: {base_url}")
+def write_run_report(path=RUN_REPORT_PATH):
+    """Write the JSON run report; an empty RUN_REPORT_PATH disables it"""
+    if not path:
+        return
+    try:
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(build_run_report(), f, ensure_ascii=False, indent=2)
+        print(f"🧾 Run report written to {path}")
+    except OSError as e:
+        print(f"⚠️  Could not write run report: {e}")
+
+def render_prometheus_metrics():
+    """Every counter and timing in Prometheus text exposition format"""
+    def labels_text(labels):
+        if not labels:
+            return ""
+        escaped = (str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", " ") for _, v in labels)
+        return "{" + ",".join(f'{k}="{v}"' for (k, _), v in zip(labels, escaped)) + "}"
+    
+    lines = []
+    with _metrics_lock:
+        counters = sorted(_metric_counters.items())
+        timings = sorted(_metric_timings.items())
+    
+    for name in sorted({name for (name, _), _ in counters}):
+        lines.append(f"# TYPE {METRICS_PREFIX}_{name}_total counter")
+        lines.extend(f"{METRICS_PREFIX}_{name}_total{labels_text(labels)} {value}"
+                     for (n, labels), value in counters if n == name)
+    for name in sorted({name for (name, _), _ in timings}):
+        lines.append(f"# TYPE {METRICS_PREFIX}_{name} summary")
+        for (n, labels), (count, total, _) in timings:
+            if n == name:
+                lines.append(f"{METRICS_PREFIX}_{name}_count{labels_text(labels)} {count}")
+                lines.append(f"{METRICS_PREFIX}_{name}_sum{labels_text(labels)} {total:.6f}")
+    return "\n".join(lines) + "\n"
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.rstrip("/") != "/metrics":
+            self.send_error(404)
+            return
+        body = render_prometheus_metrics().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+    
+    def log_message(self, format, *args):
+        # Scrapes every few seconds would drown the bot's own output
+        pass
+
+def start_metrics_server(port=METRICS_PORT):
+    """Serve /metrics in a background thread; returns the server, or None when disabled"""
+    if not port:
+        return None
+    server = ThreadingHTTPServer(("", port), _MetricsHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    print(f"📡 Prometheus metrics on http://0.0.0.0:{port}/metrics")
+    return server
+
+class HeadlineExtractor:
+    """Finds the headline elements of a listing page for one source.
+
+    Selectors are tried in order until one yields valid headlines; the one that
+    worked is remembered and tried first on the next page.
+    """
+
+    def __init__(self, selectors, min_length=0, skip_words=()):
+        self.selectors = list(selectors)
+        self.min_length = min_length
+        self.skip_words = tuple(skip_words)
+        self.last_selector = None
+
+    def is_valid(self, text):
+        if not text or len(text) <= self.min_length:
+            return False
+        lowered = text.lower()
+        return not any(word in lowered for word in self.skip_words)
+
+    def extract(self, soup):
+        """Return (selector, [(element, text), ...]) for the first selector with valid headlines"""
+        ordered = self.selectors
+        if self.last_selector:
+            ordered = [self.last_selector] + [s for s in self.selectors if s != self.last_selector]
         
-        # Use cloudscraper for medias24.com, regular requests for others
-        if "medias24.com" in base_url:
-            if not CLOUDSCRAPER_AVAILABLE:
-                print(f"    ⚠️  CloudScraper not available for medias24.com - skipping")
-                continue
-            # Will use cloudscraper instead of headers
-            use_cloudscraper = True
-        else:
-            use_cloudscraper = False
-            headers = {
-                'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36',
-                'Accept': 'text/html,application/xhtml+xml,application/xml;q=0.9,image/webp,*/*;q=0.8',
-                'Accept-Language': 'fr-FR,fr;q=0.9,en;q=0.8',
-                'Accept-Encoding': 'gzip, deflate, br',
-                'Connection': 'keep-alive',
-                'Upgrade-Insecure-Requests': '1',
-            }
+        for selector in ordered:
+            headlines = []
+            for element in soup.select(selector):
+                text = element.get_text(strip=True)
+                if self.is_valid(text):
+                    headlines.append((element, text))
+            if headlines:
+                self.last_selector = selector
+                return selector, headlines
+        return None, []
+
+class Source:
+    """Adapter for one news site.
+
+    Declares the listing URLs, how they paginate, how headlines are extracted,
+    which HTTP client fetches them and how politely. `collect` runs the whole
+    fetch/parse cycle for the site; `collect_articles` runs every registered
+    source in parallel.
+    """
+
+    def __init__(self, name, host, listing_urls, extractor, pagination="{url}/{page}", feeds=None,
+                 use_cloudscraper=False, politeness_delay=0.0, max_pages=LISTING_PAGES,
+                 max_concurrency=PER_HOST_CONCURRENCY, timeout=15):
+        self.name = name
+        self.host = host
+        self.listing_urls = list(listing_urls)
+        self.extractor = extractor
+        self.pagination = pagination
+        self.feeds = feeds or {}  # listing URL -> RSS feed URL, read before the HTML pages
+        self.use_cloudscraper = use_cloudscraper
+        self.politeness_delay = politeness_delay
+        self.max_pages = max_pages
+        self.max_concurrency = max_concurrency
+        self.timeout = timeout
+
+    def page_url(self, base_url, page):
+        """Build the listing URL for a given page number (or the feed URL)"""
+        if page == FEED_PAGE:
+            return self.feeds[base_url]
+        if page == 1:
+            return base_url
+        return self.pagination.format(url=base_url, page=page)
+
+    def absolute_link(self, link):
+        if link.startswith("http"):
+            return link
+        return f"https://{self.host}{link}"
+
+    def initial_jobs(self):
+        """Feeds where available, every listing page otherwise"""
+        jobs = []
+        for base_url in self.listing_urls:
+            if base_url in self.feeds:
+                jobs.append((self, base_url, FEED_PAGE))
+            else:
+                jobs.extend((self, base_url, page) for page in range(1, self.max_pages + 1))
+        return jobs
+
+    def get(self, url, headers):
+        """Issue a GET with this source's client (the pooled session when cloudscraper is missing)"""
+        if self.use_cloudscraper and CLOUDSCRAPER_AVAILABLE:
+            # cloudscraper brings its own browser headers, only send the conditional ones
+            conditional = {k: v for k, v in headers.items() if k.startswith('If-')}
+            return get_scraper().get(url, headers=conditional, timeout=self.timeout)
+        return get_session(url).get(url, headers=headers, timeout=self.timeout)
+
+    def collect(self, now, seen=None):
+        """Fetch and parse this source, returning its relevant articles"""
+        jobs = self.initial_jobs()
+        # Without cloudscraper the protected HTML listings are out of reach, but feeds are still
+        # worth a try with the pooled session
+        feeds_only = self.use_cloudscraper and not CLOUDSCRAPER_AVAILABLE
+        if feeds_only:
+            jobs = [job for job in jobs if job[2] == FEED_PAGE]
+            if not jobs:
+                print(f"\n📊 {self.name}: ⚠️  CloudScraper not available - skipping")
+                return []
+            print(f"\n📊 {self.name}: ⚠️  CloudScraper not available - reading feeds only, no HTML fallback")
+        
+        results = fetch_listing_pages(jobs)
+        
+        # Listings whose feed failed fall back to their HTML pages
+        fallback_jobs = []
+        for result in results:
+            if result['page'] == FEED_PAGE and result['error'] and not feeds_only:
+                print(f"    ⚠️  Feed unavailable for {result['base_url']} ({result['error']}) - falling back to HTML listing")
+                fallback_jobs.extend((self, result['base_url'], page) for page in range(1, self.max_pages + 1))
+        if fallback_jobs:
+            results = [r for r in results if not (r['page'] == FEED_PAGE and r['error'])]
+            results += fetch_listing_pages(fallback_jobs)
         
-        for page in range(1, 3):  # Check first 2 pages
+        articles = []
+        for base_url in self.listing_urls:
+            articles.extend(self.parse_results(base_url, [r for r in results if r['base_url'] == base_url],
+                                               now, seen))
+        return articles
+
+    def parse_results(self, base_url, results, now, seen=None):
+        """Parse the fetched pages of one listing in page order"""
+        print(f"\n📊 Checking: {base_url}")
+        articles = []
+        for result in results:
+            page = "RSS" if result['page'] == FEED_PAGE else result['page']
+            if result['error']:
+                print(f"    Page {page}: ❌ {result['error']} ({result['elapsed']:.2f}s)")
+                break
+            if result['not_modified']:
+                print(f"    Page {page}: ♻️  Unchanged since last run - parsing skipped ({result['elapsed']:.2f}s)")
+                if result['cache_entry']:
+                    _pending_http_cache.append(result['cache_entry'])
+                continue
+            
+            parse_start = time.perf_counter()
             try:
-                if "medias24.com" in base_url:
-                    # Different pagination for medias24
-                    url = base_url + (f"?page={page}" if page > 1 else "")
-                else:
-                    url = base_url + (f"/{page}" if page > 1 else "")
-                
-                # Use cloudscraper for medias24.com, regular requests for others
-                if use_cloudscraper:
-                    scraper = cloudscraper.create_scraper()
-                    response = scraper.get(url, timeout=30)
-                    print(f"    🔧 Using CloudScraper for medias24.com")
+                if result['page'] == FEED_PAGE:
+                    page_articles = parse_feed(self, base_url, result['response'].content, now, seen)
                 else:
-                    response = requests.get(url, headers=headers, timeout=15)
-                
-                if response.status_code == 403 and not use_cloudscraper:
-                    print(f"    ⚠️  Access blocked (403) - trying alternative approach...")
-                    # Try with different user agent
-                    headers['User-Agent'] = user_agents[1]
-                    response = requests.get(url, headers=headers, timeout=15)
-                    if response.status_code == 403:
-                        print(f"    ❌ Still blocked - website has strong anti-bot protection")
-                        break
-                elif response.status_code != 200:
-                    print(f"    ❌ HTTP {response.status_code}")
-                    if use_cloudscraper:
-                        print(f"    ⚠️  CloudScraper failed - medias24.com has additional protection")
-                    break
-                    
-                soup = BeautifulSoup(response.text, "html.parser")
-                
-                # Different selectors for different websites
-                if "medias24.com" in base_url:
-                    # Medias24 uses different HTML structure - try multiple selectors
-                    h3_tags = []
-                    
-                    # Add a small delay to allow dynamic content loading
-                    time.sleep(2)
-                    
-                    # Try various selectors for medias24
-                    selectors = [
-                        "article h3", "article h2", "div.article h3", "div.article h2",
-                        ".post-title h3", ".post-title h2", ".entry-title", 
-                        ".article-title", "h3", "h2", "h1"  # fallback
-                    ]
-                    
-                    for selector in selectors:
-                        elements = soup.select(selector)
-                        if elements:
-                            # Filter out loading messages
-                            valid_elements = []
-                            for element in elements:
-                                text = element.get_text(strip=True)
-                                if text and "chargement" not in text.lower() and len(text) > 10:
-                                    valid_elements.append(element)
-                            
-                            if valid_elements:
-                                h3_tags = valid_elements
-                                print(f"    📍 Using selector: {selector} (found {len(valid_elements)} valid elements)")
-                                break
-                    
-                    if not h3_tags:
-                        print(f"    ⚠️  No valid content found - medias24.com may be loading dynamically")
-                else:
-                    h3_tags = soup.find_all("h3")
-                
-                page_articles_found = 0
-                for h3 in h3_tags:
-                    full_text = h3.get_text(strip=True)
-                    a = h3.find("a")
-                    if not a:
-                        # Sometimes the link is in parent or sibling elements
-                        parent = h3.find_parent("a")
-                        if parent:
-                            a = parent
-                        else:
-                            continue
-                    
-                    title = a.get_text(strip=True)
-                    link = a.get("href", "")
-                    
-                    if not link:
-                        continue
-                    
-                    # Fix link format for different websites
-                    if link.startswith("http"):
-                        full_link = link
-                    elif "medias24.com" in base_url:
-                        full_link = "https://medias24.com" + link
-                    else:
-                        full_link = "https://boursenews.ma" + link
-                    
-                    # Check if recent date (last 24 hours)
-                    date_found = any(pattern in full_text for pattern in date_patterns)
-                    
-                    # STRICT check - only direct stock market relevance (works for both sites)
-                    is_stock_related, match_reason = is_strict_stock_market_related(title, full_text)
-                    
-                    if date_found and is_stock_related:
-                        importance = get_article_importance(title, full_text)
-                        article_info = {
-                            'title': title,
-                            'link': full_link,
-                            'full_text': full_text,
-                            'importance': importance,
-                            'match_reason': match_reason,
-                            'section': base_url.split('/')[-1],
-                            'source': 'Medias24' if 'medias24.com' in base_url else 'BourseNews'
-                        }
-                        all_articles.append(article_info)
-                        page_articles_found += 1
-                        print(f"      {importance['emoji']} Found: {title[:60]}...")
-                        print(f"         📍 Reason: {match_reason}")
-                        print(f"         🌐 Source: {article_info['source']}")
-                
-                print(f"    Page {page}: Found {page_articles_found} strict stock market articles")
-                
-                if page_articles_found == 0 and page > 1:
-                    break
-
+                    page_articles = parse_listing_page(self, base_url, result['response'].content, now, seen)
             except Exception as e:
                 print(f"    Page {page}: Error - {e}")
                 break
+            finally:
+                record_timing("parse_seconds", time.perf_counter() - parse_start,
+                              source=self.name, kind="feed" if result['page'] == FEED_PAGE else "html")
+            
+            articles.extend(page_articles)
+            if result['cache_entry']:
+                _pending_http_cache.append(result['cache_entry'])
+            print(f"    Page {page}: Found {len(page_articles)} strict stock market articles ({result['elapsed']:.2f}s)")
+            
+            if not page_articles and result['page'] != FEED_PAGE and page > 1:
+                break
+        return articles
+
+# Source registry, keyed by host
+SOURCES = {}
+
+def register_source(source):
+    """Add a source adapter to the registry used by get_today_articles"""
+    SOURCES[source.host] = source
+    return source
 
-    # Sort by importance (most important first)
-    all_articles.sort(key=lambda x: x['importance']['level'], reverse=True)
+def get_source_for_url(url):
+    host = urlparse(url).netloc.lower()
+    if host.startswith("www."):
+        host = host[4:]
+    return SOURCES.get(host)
+
+register_source(Source(
+    name="BourseNews",
+    host="boursenews.ma",
+    listing_urls=[
+        "https://boursenews.ma/articles/actualite",
+        "https://boursenews.ma/articles/marches",
+    ],
+    extractor=HeadlineExtractor(["h3"]),
+    pagination="{url}/{page}",
+))
+
+register_source(Source(
+    name="Medias24",
+    host="medias24.com",
+    listing_urls=["https://medias24.com/categorie/leboursier/actus/"],
+    # Medias24 uses different HTML structure - try multiple selectors, filter out loading messages
+    extractor=HeadlineExtractor(
+        [
+            "article h3", "article h2", "div.article h3", "div.article h2",
+            ".post-title h3", ".post-title h2", ".entry-title",
+            ".article-title", "h3", "h2", "h1"  # fallback
+        ],
+        min_length=10,
+        skip_words=("chargement",),
+    ),
+    pagination="{url}?page={page}",
+    # The RSS feed has real dates and no "chargement" placeholders
+    feeds={
+        "https://medias24.com/categorie/leboursier/actus/": "https://medias24.com/categorie/leboursier/actus/feed/",
+    },
+    use_cloudscraper=True,
+    politeness_delay=float(os.getenv("MEDIAS24_POLITENESS_DELAY", "1.0")),
+    timeout=30,
+))
+
+def fetch_listing_page(source, base_url, page):
+    """Download one listing page; never raises, errors are reported in the result dict"""
+    url = source.page_url(base_url, page)
+    result = {
+        'base_url': base_url, 'page': page, 'url': url, 'response': None, 'error': None,
+        'elapsed': 0.0, 'not_modified': False, 'cache_entry': None,
+    }
+    
+    headers = dict(BROWSER_HEADERS)
+    
+    # Conditional GET: send the validators stored on the previous run
+    cached = get_http_cache_entry(url) if HTTP_CACHE_ENABLED else None
+    if cached:
+        if cached['etag']:
+            headers['If-None-Match'] = cached['etag']
+        if cached['last_modified']:
+            headers['If-Modified-Since'] = cached['last_modified']
+    
+    host = urlparse(url).netloc
+    with _get_host_semaphore(host, source.max_concurrency):
+        _wait_for_politeness_slot(host, source.politeness_delay)
+        start = time.perf_counter()
+        try:
+            response = source.get(url, headers)
+            
+            if response.status_code == 304:
+                result['not_modified'] = True
+            elif response.status_code == 403 and not source.use_cloudscraper:
+                print(f"    ⚠️  {url}: access blocked (403) - trying alternative approach...")
+                # Try with different user agent
+                headers['User-Agent'] = USER_AGENTS[1]
+                response = source.get(url, headers)
+                if response.status_code == 403:
+                    result['error'] = "Still blocked - website has strong anti-bot protection"
+            elif response.status_code != 200:
+                result['error'] = f"HTTP {response.status_code}"
+                if source.use_cloudscraper:
+                    result['error'] += f" - {source.host} has additional protection"
+            
+            if result['error'] is None and page == FEED_PAGE and b"<rss" not in response.content[:1024]:
+                # Typically a Cloudflare challenge page served with a 200
+                result['error'] = "Response is not an RSS feed"
+            
+            if result['error'] is None and not result['not_modified']:
+                # Servers without validators: fall back to comparing the body hash
+                body_hash = hashlib.sha256(response.content).hexdigest()
+                result['not_modified'] = bool(cached) and cached['body_hash'] == body_hash
+                result['cache_entry'] = (
+                    url, response.headers.get('ETag'), response.headers.get('Last-Modified'), body_hash
+                )
+                result['response'] = response
+        except Exception as e:
+            result['error'] = str(e)
+        result['elapsed'] = time.perf_counter() - start
+    
+    record_fetch(source, result, host)
+    return result
+
+def record_fetch(source, result, host):
+    """Record latency, size and outcome of one page request"""
+    response = result['response']
+    size = len(response.content) if response is not None else 0
+    outcome = "error" if result['error'] else "not_modified" if result['not_modified'] else "ok"
+    record_timing("fetch_seconds", result['elapsed'], host=host)
+    record_count("fetch_pages", host=host, outcome=outcome)
+    record_count("fetch_bytes", size, host=host)
+    if outcome != "error" and result['page'] != ARTICLE_PAGE:
+        record_count("http_cache", result="hit" if result['not_modified'] else "miss")
+    with _metrics_lock:
+        _fetch_log.append({
+            'source': source.name,
+            'url': result['url'],
+            'page': result['page'],
+            'outcome': outcome,
+            'error': result['error'],
+            'elapsed_s': round(result['elapsed'], 4),
+            'bytes': size,
+        })
+
+def fetch_listing_pages(jobs):
+    """Fetch every (source, base_url, page) job concurrently, results returned in job order"""
+    if not jobs:
+        return []
+    with ThreadPoolExecutor(max_workers=min(MAX_FETCH_WORKERS, len(jobs))) as executor:
+        return list(executor.map(lambda job: fetch_listing_page(*job), jobs))
+
+def extract_headlines(source, html):
+    """Parse only headline elements of html and return [(element, text), ...]"""
+    if isinstance(source, str):
+        source = get_source_for_url(source)
+    soup = BeautifulSoup(html, HTML_PARSER, parse_only=HEADLINE_STRAINER)
+    selector, headlines = source.extractor.extract(soup)
+    if len(source.extractor.selectors) > 1:
+        if headlines:
+            print(f"    📍 Using selector: {selector} (found {len(headlines)} valid elements)")
+        else:
+            print(f"    ⚠️  No valid content found - {source.host} may be loading dynamically")
+    return headlines
+
+def parse_listing_page(source, base_url, html, now, seen=None):
+    """Extract strict stock market articles from a downloaded listing page"""
+    headlines = extract_headlines(source, html)
+    
+    page_articles = []
+    for h3, full_text in headlines:
+        a = h3.find("a")
+        if not a:
+            # Sometimes the link is in parent or sibling elements
+            parent = h3.find_parent("a")
+            if parent:
+                a = parent
+            else:
+                continue
+        
+        title = a.get_text(strip=True)
+        link = a.get("href", "")
+        
+        if not link:
+            continue
+        
+        # Fix link format for different websites
+        full_link = source.absolute_link(link)
+        
+        # Check if recent date (inside the freshness window)
+        published, has_time = parse_french_datetime(full_text, now)
+        if published is None or not is_fresh(published, has_time, now):
+            record_count("articles_filtered", reason="Outside freshness window")
+            continue
+        
+        article_info = build_article(source, base_url, title, full_link, full_text, published, seen)
+        if article_info:
+            page_articles.append(article_info)
+    
+    return page_articles
+
+def build_article(source, base_url, title, full_link, full_text, published, seen=None):
+    """Score a dated headline and return its article dict, or None when it is not relevant"""
+    # Skip articles already processed in a previous run
+    if seen is not None and is_article_seen(seen, full_link, title):
+        record_count("articles_filtered", reason="Already seen")
+        return None
+    
+    # STRICT check - only direct stock market relevance (works for every source)
+    hits = match_keywords(title + " " + full_text)
+    is_stock_related, match_reason = is_strict_stock_market_related(title, full_text, hits)
+    if not is_stock_related:
+        record_count("articles_filtered", reason=match_reason)
+        return None
+    record_count("articles_matched", reason=match_reason)
+    
+    importance = get_article_importance(title, full_text, hits)
+    article_info = {
+        'title': title,
+        'link': full_link,
+        'full_text': full_text,
+        'published': published,
+        'importance': importance,
+        'match_reason': match_reason,
+        'companies': hits['company'],
+        'tickers': company_tickers(hits['company']),
+        'keywords': article_keywords(hits),
+        'section': base_url.rstrip('/').split('/')[-1],
+        'source': source.name
+    }
+    print(f"      {importance['emoji']} Found: {title[:60]}...")
+    print(f"         📍 Reason: {match_reason}")
+    print(f"         🌐 Source: {article_info['source']}")
+    return article_info
+
+def parse_feed(source, base_url, xml_content, now, seen=None):
+    """Extract strict stock market articles from an RSS feed"""
+    root = ElementTree.fromstring(xml_content)
+    feed_articles = []
+    for item in root.iter("item"):
+        title = (item.findtext("title") or "").strip()
+        link = (item.findtext("link") or "").strip()
+        if not title or not link:
+            continue
+        
+        pub_date = item.findtext("pubDate")
+        try:
+            # Feed dates are timezone-aware; articles carry naive Casablanca times like the HTML listings
+            published = parsedate_to_datetime(pub_date) if pub_date else None
+            if published is not None:
+                if published.tzinfo is None:
+                    published = published.replace(tzinfo=timezone.utc)  # "-0000": UTC, source zone unknown
+                published = published.astimezone(MARKET_TIMEZONE).replace(tzinfo=None)
+        except (TypeError, ValueError):
+            published = None
+        
+        # Check if recent date (inside the freshness window)
+        if published is None or not is_fresh(published, True, now):
+            record_count("articles_filtered", reason="Outside freshness window")
+            continue
+        
+        # The feed excerpt gives the relevance check more than the bare headline
+        description = BeautifulSoup(item.findtext("description") or "", HTML_PARSER).get_text(" ", strip=True)
+        full_text = " ".join(part for part in (title, description) if part)
+        
+        article_info = build_article(source, base_url, title, source.absolute_link(link), full_text, published, seen)
+        if article_info:
+            feed_articles.append(article_info)
+    
+    return feed_articles
+
+def collect_articles(sources, now, seen=None):
+    """Run every source adapter in parallel and merge their articles"""
+    if not sources:
+        return []
+    with ThreadPoolExecutor(max_workers=len(sources)) as executor:
+        per_source = list(executor.map(lambda source: source.collect(now, seen), sources))
+    return [article for articles in per_source for article in articles]
+
+def extract_article_body(html):
+    """Main text of an article page: its substantial paragraphs, preferring those inside <article>"""
+    soup = BeautifulSoup(html, HTML_PARSER, parse_only=ARTICLE_BODY_STRAINER)
+    paragraphs = soup.select("article p") or soup.find_all("p")
+    texts = []
+    for paragraph in paragraphs:
+        text = " ".join(paragraph.get_text(" ", strip=True).split())
+        if len(text) >= ARTICLE_MIN_PARAGRAPH_LENGTH and text not in texts:
+            texts.append(text)
+    return " ".join(texts)
+
+def extract_key_figures(text):
+    """First distinct amounts and percentages quoted in text"""
+    figures = []
+    for match in _FIGURE_RE.finditer(text):
+        figure = " ".join(match.group().split())
+        if figure not in figures:
+            figures.append(figure)
+            if len(figures) == ARTICLE_MAX_FIGURES:
+                break
+    return figures
+
+def truncate_text(text, limit):
+    """Cut text at the last word boundary before limit"""
+    if len(text) <= limit:
+        return text
+    return text[:limit].rsplit(" ", 1)[0] + "…"
+
+def fetch_article_body(article):
+    """Download one article page with its source's client; returns (body, figures) or None"""
+    url = article['link']
+    source = get_source_for_url(url)
+    if source is None or (source.use_cloudscraper and not CLOUDSCRAPER_AVAILABLE):
+        return None
+    
+    result = {'url': url, 'page': ARTICLE_PAGE, 'response': None, 'error': None, 'elapsed': 0.0, 'not_modified': False}
+    host = urlparse(url).netloc
+    with _get_host_semaphore(host, source.max_concurrency):
+        _wait_for_politeness_slot(host, source.politeness_delay)
+        start = time.perf_counter()
+        try:
+            result['response'] = source.get(url, dict(BROWSER_HEADERS))
+            if result['response'].status_code != 200:
+                result['error'] = f"HTTP {result['response'].status_code}"
+        except Exception as e:
+            result['error'] = str(e)
+        result['elapsed'] = time.perf_counter() - start
+    record_fetch(source, result, host)
+    
+    if result['error']:
+        print(f"    ⚠️  Article body unavailable for {url} ({result['error']})")
+        return None
+    text = extract_article_body(result['response'].content)
+    return truncate_text(text, ARTICLE_BODY_MAX_CHARS), extract_key_figures(text)
+
+def fetch_article_bodies(articles):
+    """Attach 'body' and 'figures' to the selected articles and rescore them with the body text.
+
+    Only the articles that passed the headline filter are fetched, in parallel;
+    bodies are cached in the state database so a story is downloaded once.
+    """
+    if not articles:
+        return
+    start = time.perf_counter()
+    urls = [normalize_article_url(a['link']) for a in articles]
+    cached = get_cached_article_bodies(urls)
+    missing = [i for i, url in enumerate(urls) if url not in cached]
+    record_count("article_body_cache", len(articles) - len(missing), result="hit")
+    record_count("article_body_cache", len(missing), result="miss")
+    
+    fetched = {}
+    if missing:
+        with ThreadPoolExecutor(max_workers=min(ARTICLE_FETCH_WORKERS, len(missing))) as executor:
+            bodies = list(executor.map(lambda i: fetch_article_body(articles[i]), missing))
+        fetched = {urls[i]: body for i, body in zip(missing, bodies) if body is not None}
+        store_article_bodies(fetched)
+    
+    for article, url in zip(articles, urls):
+        body, figures = cached.get(url) or fetched.get(url) or ("", [])
+        article['body'] = body
+        article['figures'] = figures
+        if not body:
+            continue
+        # The body can reveal importance and companies the headline does not mention
+        hits = match_keywords(f"{article['title']} {article['full_text']} {body}")
+        importance = get_article_importance(article['title'], body, hits)
+        if importance['level'] > article['importance']['level']:
+            article['importance'] = importance
+        article['companies'] += [c for c in hits['company'] if c not in article['companies']]
+        article['tickers'] = company_tickers(article['companies'])
+        article['keywords'] += [k for k in article_keywords(hits) if k not in article['keywords']]
+    
+    elapsed = time.perf_counter() - start
+    record_timing("stage_seconds", elapsed, stage="bodies")
+    print(f"📰 Article bodies: {len(articles) - len(missing)} cached, {len(fetched)}/{len(missing)} fetched ({elapsed:.2f}s)")
+
+def get_today_articles(sources=None, now=None):
+    run_start = time.perf_counter()
+    sources = list(SOURCES.values()) if sources is None else sources
+    now = now or market_now()
+    seen = load_seen_articles()
+    with _metrics_lock:
+        _fetch_log.clear()
+    
+    print(f"🔍 Looking for STRICT Casablanca stock market & IPO articles from last {FRESHNESS_HOURS} hours...")
+    print(f"📅 Freshness window: since {now - timedelta(hours=FRESHNESS_HOURS):%d/%m/%Y %H:%M}")
+    print(f"🗂️  Seen store: {len(seen['urls'])} articles already processed")
+    print(f"🌐 Sources: {', '.join(source.name for source in sources)}")
+
+    all_articles = collect_articles(sources, now, seen)
+    if FETCH_ARTICLE_BODIES:
+        fetch_article_bodies(all_articles)
+
+    # Sort by importance (most important first), newest first within a level
+    all_articles.sort(key=lambda x: (x['importance']['level'], x['published']), reverse=True)
     
     print(f"\n🎯 Total STRICT stock market articles found: {len(all_articles)}")
+    print(f"⏱️  Scrape run took {time.perf_counter() - run_start:.2f}s")
+    record_timing("stage_seconds", time.perf_counter() - run_start, stage="scrape")
+    record_count("articles_selected", len(all_articles))
     return all_articles
 
-def is_strict_stock_market_related(title, content):
+def normalize_alias(text):
+    """Lookup form of a company alias: lowercase, single spaces, straight apostrophes"""
+    return " ".join(text.lower().replace("’", "'").split())
+
+def is_valid_isin(code):
+    """True when code is a 12-character ISIN whose check digit matches"""
+    if not code or not re.fullmatch(r"[A-Z]{2}[A-Z0-9]{9}\d", code):
+        return False
+    digits = "".join(str(int(c, 36)) for c in code)
+    total = 0
+    for position, digit in enumerate(reversed(digits)):
+        value = int(digit) * (2 if position % 2 else 1)
+        total += value // 10 + value % 10
+    return total % 10 == 0
+
+def load_issuer_isins(path=None):
+    """{ticker: ISIN} from the exchange's issuer list, empty when the file is absent"""
+    path = path or ISSUER_LIST_PATH
+    if not os.path.exists(path):
+        return {}
+    with open(path, encoding="utf-8-sig", newline="") as f:
+        sample = f.read(4096)
+        f.seek(0)
+        rows = csv.DictReader(f, dialect=csv.Sniffer().sniff(sample, delimiters=",;\t"))
+        isins = {}
+        for row in rows:
+            row = {(key or "").strip().lower(): (value or "").strip() for key, value in row.items()}
+            ticker = (row.get("ticker") or row.get("code") or row.get("symbole") or "").upper()
+            isin = row.get("isin", "").upper()
+            if not ticker:
+                continue
+            if is_valid_isin(isin):
+                isins[ticker] = isin
+            else:
+                print(f"⚠️  Issuer list: invalid ISIN {isin!r} for {ticker} - ignored")
+    return isins
+
+def get_entity_index():
+    """Load the listed companies index once; returns (companies, {normalized alias: company}, {ticker: company})"""
+    global _entity_index
+    with _entity_index_lock:
+        if _entity_index is None:
+            with open(ENTITY_INDEX_PATH, encoding="utf-8") as f:
+                companies = json.load(f)["companies"]
+            isins = load_issuer_isins()
+            for company in companies:
+                isin = isins.get(company['ticker']) or company.get('isin')
+                company['isin'] = isin if is_valid_isin(isin) else None
+            aliases = {}
+            for company in companies:
+                for alias in [company['name']] + company['aliases']:
+                    aliases.setdefault(normalize_alias(alias), company)
+            tickers = {company['ticker']: company for company in companies if company['ticker']}
+            _entity_index = (companies, aliases, tickers)
+        return _entity_index
+
+def lookup_company(alias):
+    """Company entry cited as alias, or None"""
+    return get_entity_index()[1].get(normalize_alias(alias))
+
+def listed_company_aliases():
+    """Every alias of every listed company, in index order"""
+    return list(get_entity_index()[1])
+
+def company_tickers(aliases):
+    """Canonical tickers of the companies behind aliases, without duplicates"""
+    tickers = []
+    for alias in aliases:
+        company = lookup_company(alias)
+        if company and company['ticker'] and company['ticker'] not in tickers:
+            tickers.append(company['ticker'])
+    return tickers
+
+def article_keywords(hits):
+    """Market keywords found in an article, the vocabulary keyword subscriptions follow"""
+    keywords = []
+    for category in ('stock', 'high', 'medium'):
+        keywords += [k for k in hits[category] if k not in keywords]
+    return keywords
+
+def get_keyword_matcher():
+    """Build the keyword matcher on first use, once the entity index is loaded"""
+    global _keyword_matcher
+    with _keyword_matcher_lock:
+        if _keyword_matcher is None:
+            _keyword_matcher = _build_keyword_matcher({**KEYWORD_CATEGORIES, 'company': listed_company_aliases()})
+        return _keyword_matcher
+
+def _keyword_trie_pattern(keywords):
+    """Regex alternation of keywords factored as a character trie.
+
+    The engine follows a single branch per character instead of trying every
+    keyword at each position, so the cost barely grows with the alias list.
+    Optional tails are greedy: "attijariwafa bank" is preferred over "attijariwafa".
+    """
+    trie = {}
+    for keyword in keywords:
+        node = trie
+        for char in keyword:
+            node = node.setdefault(char, {})
+        node[""] = {}  # End of a keyword
+    
+    def emit(node):
+        branches = [re.escape(char) + emit(child) for char, child in sorted(node.items()) if char]
+        if not branches:
+            return ""
+        body = branches[0] if len(branches) == 1 else "(?:" + "|".join(branches) + ")"
+        return f"(?:{body})?" if "" in node else body
+    
+    return emit(trie)
+
+def _build_keyword_matcher(categories):
+    """Compile every keyword of every category into a single word-bounded regex"""
+    keyword_categories = {}
+    keyword_rank = {}
+    for category, keywords in categories.items():
+        for rank, keyword in enumerate(keywords):
+            keyword_categories.setdefault(keyword, set()).add(category)
+            keyword_rank.setdefault((category, keyword), rank)
+    
+    # A match on "cih bank" or "suspension de cotation" also counts as "cih" / "suspension",
+    # because the scan only reports the longest keyword starting at each position.
+    # Exclusions are never implied by another category: "banque centrale populaire" is a listed bank
+    implied = {}
+    for keyword in keyword_categories:
+        implied[keyword] = [
+            other for other in keyword_categories
+            if keyword.startswith(other) and (len(other) == len(keyword) or not keyword[len(other)].isalnum())
+            and ('exclude' not in keyword_categories[other] or 'exclude' in keyword_categories[keyword])
+        ]
+    
+    # The zero-width lookahead lets overlapping keywords ("cotation" inside "suspension de cotation") match too
+    pattern = re.compile(rf"(?=\b({_keyword_trie_pattern(keyword_categories)})s?\b)")
+    return pattern, categories, keyword_categories, keyword_rank, implied
+
+def match_keywords(text):
+    """Scan text once and return, per category, every keyword found (in list priority order)"""
+    pattern, categories, keyword_categories, keyword_rank, implied = get_keyword_matcher()
+    found = set()
+    for match in pattern.finditer(text.lower().replace("’", "'")):
+        found.update(implied[match.group(1)])
+    
+    hits = {category: [] for category in categories}
+    for keyword in found:
+        for category in keyword_categories[keyword]:
+            hits[category].append(keyword)
+    for category, keywords in hits.items():
+        keywords.sort(key=lambda k: keyword_rank[(category, k)])
+    return hits
+
+def is_strict_stock_market_related(title, content, hits=None):
     """STRICT check - only direct Casablanca stock market and IPO relevance"""
-    text_to_check = (title + " " + content).lower()
+    if hits is None:
+        hits = match_keywords(title + " " + content)
     
     # Exclude general economic/international news
-    exclude_keywords = [
-        "inflation", "pib", "croissance économique", "banque centrale", "politique monétaire",
-        "bourses européennes", "bourse américaine", "wall street", "euro stoxx", "s&p",
-        "onee", "oncf", "adm", "onda", "ram", "banque mondiale", "fmi"
-    ]
-    
-    for exclude in exclude_keywords:
-        if exclude in text_to_check:
-            return False, f"Excluded: {exclude}"
+    if hits['exclude']:
+        return False, f"Excluded: {hits['exclude'][0]}"
     
     # Check for strict stock market keywords
-    for keyword in STRICT_STOCK_KEYWORDS:
-        if keyword in text_to_check:
-            return True, f"Stock keyword: {keyword}"
+    if hits['stock']:
+        return True, f"Stock keyword: {hits['stock'][0]}"
     
     # Check for listed companies (strict matching)
-    for company in LISTED_COMPANIES:
-        if company in text_to_check:
-            return True, f"Listed company: {company}"
+    if hits['company']:
+        return True, f"Listed company: {hits['company'][0]}"
     
     return False, "No direct stock market relevance"
 
-def get_article_importance(title, content):
+def get_article_importance(title, content, hits=None):
     """Determine article importance and assign emoji"""
-    text_to_check = (title + " " + content).lower()
+    if hits is None:
+        hits = match_keywords(title + " " + content)
     
     # High importance: IPOs, major corporate actions, index movements
-    for keyword in HIGH_IMPORTANCE_KEYWORDS:
-        if keyword in text_to_check:
-            return {'level': 3, 'emoji': '🚨', 'label': 'Très Important', 'matched': keyword}
+    if hits['high']:
+        return {'level': 3, 'emoji': '🚨', 'label': 'Très Important', 'matched': hits['high'][0]}
     
     # Medium importance: Company financial results, strategic moves
-    medium_keywords = ["résultat", "chiffre d'affaires", "bénéfice", "stratégie", "partenariat", "investissement"]
-    for keyword in medium_keywords:
-        if keyword in text_to_check:
-            return {'level': 2, 'emoji': '📈', 'label': 'Important', 'matched': keyword}
+    if hits['medium']:
+        return {'level': 2, 'emoji': '📈', 'label': 'Important', 'matched': hits['medium'][0]}
     
     # Normal importance: General company news
     return {'level': 1, 'emoji': '📊', 'label': 'Standard', 'matched': 'général'}
 
-def summarize_articles_with_gemini(articles, api_key=GEMINI_API_KEY):
-    """Create ORIGINAL Arabic summaries for stock market articles with duplicate detection"""
-    if not articles:
-        return "📭 لا توجد أخبار متعلقة ببورصة الدار البيضاء اليوم."
+def get_state_db():
+    """Return the shared SQLite connection holding the bot's persistent state"""
+    global _state_db, _archive_fts_available
+    with _state_db_lock:
+        if _state_db is None:
+            _state_db = sqlite3.connect(STATE_DB_PATH, check_same_thread=False)
+            for statement in STATE_SCHEMA:
+                _state_db.execute(statement)
+            try:
+                for statement in ARCHIVE_FTS_SCHEMA:
+                    _state_db.execute(statement)
+                _archive_fts_available = True
+            except sqlite3.OperationalError as e:
+                print(f"⚠️  SQLite full-text search unavailable ({e}) - archive search falls back to LIKE")
+            _state_db.commit()
+        return _state_db
+
+def normalize_article_url(link):
+    """Canonical form of an article URL: lowercase host, no www, fragment, tracking params or trailing slash"""
+    parsed = urlparse(link.strip())
+    host = parsed.netloc.lower()
+    if host.startswith("www."):
+        host = host[4:]
+    query = urlencode([(k, v) for k, v in parse_qsl(parsed.query) if not k.startswith("utm_")])
+    path = parsed.path.rstrip("/") or "/"
+    return f"{parsed.scheme.lower() or 'https'}://{host}{path}" + (f"?{query}" if query else "")
+
+def article_title_hash(title):
+    """Stable hash of a headline, insensitive to case and spacing"""
+    normalized = " ".join(title.lower().split())
+    return hashlib.sha1(normalized.encode("utf-8")).hexdigest()
+
+def load_seen_articles():
+    """Evict expired entries and return the URLs already processed, and the headlines processed today.
+
+    Headlines only count for the current day: recurring titles such as the daily
+    "ouverture en hausse" wrap are new stories under a new URL every day.
+    """
+    today_start = datetime.now(MARKET_TIMEZONE).replace(hour=0, minute=0, second=0, microsecond=0).timestamp()
+    db = get_state_db()
+    with _state_db_lock:
+        db.execute("DELETE FROM seen_articles WHERE seen_at < ?", (time.time() - SEEN_TTL_DAYS * 86400,))
+        db.commit()
+        rows = db.execute("SELECT url, title_hash, seen_at FROM seen_articles").fetchall()
+    return {'urls': {row[0] for row in rows}, 'title_hashes': {row[1] for row in rows if row[2] >= today_start}}
+
+def is_article_seen(seen, link, title):
+    """True when the article URL was already processed, or its headline was today under another URL"""
+    return normalize_article_url(link) in seen['urls'] or article_title_hash(title) in seen['title_hashes']
+
+def mark_articles_seen(articles):
+    """Record delivered articles so they are not sent again"""
+    now = time.time()
+    rows = [(normalize_article_url(a['link']), article_title_hash(a['title']), now) for a in articles]
+    db = get_state_db()
+    with _state_db_lock:
+        db.executemany("INSERT OR REPLACE INTO seen_articles (url, title_hash, seen_at) VALUES (?, ?, ?)", rows)
+        db.commit()
+
+def get_http_cache_entry(url):
+    """Return the validators and body hash stored for url, or None"""
+    db = get_state_db()
+    with _state_db_lock:
+        row = db.execute("SELECT etag, last_modified, body_hash FROM http_cache WHERE url = ?", (url,)).fetchone()
+    if row is None:
+        return None
+    return {'etag': row[0], 'last_modified': row[1], 'body_hash': row[2]}
+
+def commit_http_cache():
+    """Persist validators of the pages parsed this run"""
+    now = time.time()
+    rows = [entry + (now,) for entry in _pending_http_cache]
+    db = get_state_db()
+    with _state_db_lock:
+        db.executemany(
+            "INSERT OR REPLACE INTO http_cache (url, etag, last_modified, body_hash, fetched_at) VALUES (?, ?, ?, ?, ?)",
+            rows,
+        )
+        db.commit()
+    _pending_http_cache.clear()
+
+def commit_run_state(articles):
+    """Mark a delivered run as done: its articles are seen and its pages cached"""
+    mark_articles_seen(articles)
+    commit_http_cache()
+
+def queue_pending_articles(articles):
+    """Persist articles waiting for the daemon's next digest"""
+    now = time.time()
+    rows = [
+        (normalize_article_url(a['link']),
+         json.dumps(dict(a, published=a['published'] and a['published'].isoformat()), ensure_ascii=False), now)
+        for a in articles
+    ]
+    db = get_state_db()
+    with _state_db_lock:
+        db.executemany("INSERT OR REPLACE INTO pending_digest (url, article, queued_at) VALUES (?, ?, ?)", rows)
+        db.commit()
+
+def load_pending_articles():
+    """Return {normalized URL: article} of the digest queue left by a previous daemon"""
+    db = get_state_db()
+    with _state_db_lock:
+        rows = db.execute("SELECT url, article FROM pending_digest ORDER BY queued_at").fetchall()
+    pending = {}
+    for url, entry in rows:
+        article = json.loads(entry)
+        article['published'] = article['published'] and datetime.fromisoformat(article['published'])
+        pending[url] = article
+    return pending
+
+def clear_pending_articles():
+    """Empty the digest queue once the digest is delivered"""
+    db = get_state_db()
+    with _state_db_lock:
+        db.execute("DELETE FROM pending_digest")
+        db.commit()
+
+def resolve_subscription_topic(topic):
+    """Turn a CLI topic (ticker, ISIN, company alias, market keyword or "all") into a (kind, value) pair"""
+    companies, aliases, tickers = get_entity_index()
+    normalized = normalize_alias(topic)
+    if normalized in ("all", "*"):
+        return "all", "*"
+    if topic.upper() in tickers:
+        return "ticker", topic.upper()
+    company = aliases.get(normalized) or next((c for c in companies if c['isin'] == topic.upper()), None)
+    if company and company['ticker']:
+        return "ticker", company['ticker']
+    if normalized in STRICT_STOCK_KEYWORDS + HIGH_IMPORTANCE_KEYWORDS + MEDIUM_IMPORTANCE_KEYWORDS:
+        return "keyword", normalized
+    raise ValueError(f"Unknown ticker, ISIN, company or keyword: {topic}")
+
+def add_subscription(chat_id, topic, min_importance=1):
+    """Subscribe chat_id to topic; returns the stored (kind, value)"""
+    kind, value = resolve_subscription_topic(topic)
+    db = get_state_db()
+    with _state_db_lock:
+        db.execute(
+            "INSERT OR REPLACE INTO subscriptions (chat_id, kind, value, min_importance, created_at) VALUES (?, ?, ?, ?, ?)",
+            (str(chat_id), kind, value, min_importance, time.time()),
+        )
+        db.commit()
+    invalidate_subscription_index()
+    return kind, value
+
+def remove_subscriptions(chat_id, topic=None):
+    """Remove one subscription of chat_id, or all of them; returns how many were removed"""
+    db = get_state_db()
+    with _state_db_lock:
+        if topic is None:
+            cursor = db.execute("DELETE FROM subscriptions WHERE chat_id = ?", (str(chat_id),))
+        else:
+            kind, value = resolve_subscription_topic(topic)
+            cursor = db.execute(
+                "DELETE FROM subscriptions WHERE chat_id = ? AND kind = ? AND value = ?", (str(chat_id), kind, value)
+            )
+        db.commit()
+    invalidate_subscription_index()
+    return cursor.rowcount
+
+def list_subscriptions(chat_id=None):
+    """[(chat_id, kind, value, min_importance)], optionally for one chat"""
+    db = get_state_db()
+    query = "SELECT chat_id, kind, value, min_importance FROM subscriptions"
+    with _state_db_lock:
+        if chat_id is None:
+            return db.execute(query + " ORDER BY chat_id, kind, value").fetchall()
+        return db.execute(query + " WHERE chat_id = ? ORDER BY kind, value", (str(chat_id),)).fetchall()
+
+def get_subscription_index():
+    """Return the inverted index of the subscriptions table, rebuilt when it may be stale"""
+    global _subscription_index, _subscription_index_version
+    db = get_state_db()
+    with _subscription_index_lock:
+        # data_version changes when another connection commits, e.g. a subscribe command run
+        # while the daemon is up; this process's own writes invalidate the index directly
+        with _state_db_lock:
+            version = db.execute("PRAGMA data_version").fetchone()[0]
+        if _subscription_index is None or version != _subscription_index_version:
+            index = {}
+            for chat_id, kind, value, min_importance in list_subscriptions():
+                index.setdefault((kind, value), {})[chat_id] = min_importance
+            _subscription_index, _subscription_index_version = index, version
+        return _subscription_index
+
+def invalidate_subscription_index():
+    global _subscription_index
+    with _subscription_index_lock:
+        _subscription_index = None
+
+def route_to_subscribers(articles):
+    """{chat_id: [article indices]} of the subscribers following each article.
+
+    Each article is resolved with one index lookup per ticker and keyword it
+    carries, whatever the number of subscribers.
+    """
+    index = get_subscription_index()
+    routes = {}
+    for i, article in enumerate(articles):
+        keys = [("all", "*")]
+        keys += [("ticker", ticker) for ticker in article.get('tickers', [])]
+        keys += [("keyword", keyword) for keyword in article.get('keywords', [])]
+        level = article['importance']['level']
+        recipients = set()
+        for key in keys:
+            recipients.update(chat_id for chat_id, minimum in index.get(key, {}).items() if level >= minimum)
+        for chat_id in recipients:
+            routes.setdefault(chat_id, []).append(i)
+    return routes
+
+def archive_articles(articles, summaries=()):
+    """Bulk-store delivered articles with their summary and update the daily counts.
+
+    summaries are the (entry, representative) pairs of summarize_articles; every
+    member of a cluster or model merge is archived with the story's summary.
+    """
+    if not ARCHIVE_ENABLED or not articles:
+        return
+    summary_by_link = {}
+    for entry, representative in summaries:
+        linked = (representative.get('sources') or [representative]) + entry.get('merged_sources', [])
+        for source in linked:
+            summary_by_link.setdefault(source['link'], f"{entry['title']} - {entry['summary']}")
+    
+    now = time.time()
+    rows = [(
+        normalize_article_url(a['link']), a['title'], a['link'], a['source'], a.get('section'),
+        a['importance']['level'], a.get('match_reason'), " ".join(a.get('tickers', [])),
+        json.dumps(a.get('keywords', []), ensure_ascii=False), summary_by_link.get(a['link']),
+        (a['published'] or market_now()).isoformat(timespec="seconds"), now,
+    ) for a in articles]
     
-    # Group articles by company/topic to detect potential duplicates
-    companies_mentioned = {}
+    db = get_state_db()
+    with _state_db_lock:
+        known = {row[0] for row in db.execute(
+            f"SELECT url FROM articles_archive WHERE url IN ({','.join('?' * len(rows))})", [row[0] for row in rows]
+        )}
+        db.executemany(
+            "INSERT INTO articles_archive (url, title, link, source, section, importance, match_reason, tickers, "
+            "keywords, summary, published, archived_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?) "
+            "ON CONFLICT (url) DO UPDATE SET importance = excluded.importance, tickers = excluded.tickers, "
+            "keywords = excluded.keywords, summary = COALESCE(excluded.summary, summary)",
+            rows,
+        )
+        
+        # Daily counts are precomputed once per new article; '*' counts every article of the day
+        counts = {}
+        for row in rows:
+            if row[0] in known:
+                continue
+            day, level = row[10][:10], row[5]
+            for ticker in row[7].split() + ["*"]:
+                counts[(day, ticker, level)] = counts.get((day, ticker, level), 0) + 1
+        db.executemany(
+            "INSERT INTO archive_daily_counts (day, ticker, importance, articles) VALUES (?, ?, ?, ?) "
+            "ON CONFLICT (day, ticker, importance) DO UPDATE SET articles = articles + excluded.articles",
+            [key + (count,) for key, count in counts.items()],
+        )
+        db.commit()
+    print(f"🗄️  Archive: {len(rows) - len(known)} new, {len(known)} updated")
+
+def search_archive(query=None, ticker=None, since=None, limit=20):
+    """Archived articles matching the words of query and/or a ticker, newest first"""
+    db = get_state_db()
+    conditions, params = [], []
+    if since:
+        conditions.append("a.published >= ?")
+        params.append(since)
+    
+    if _archive_fts_available and (query or ticker):
+        # Every word is quoted: user input never reaches the FTS query syntax
+        terms = [f'"{word.replace(chr(34), "")}"' for word in (query or "").split()]
+        if ticker:
+            terms.append(f'tickers : "{ticker.upper()}"')
+        sql = "SELECT a.* FROM articles_fts JOIN articles_archive a ON a.id = articles_fts.rowid WHERE articles_fts MATCH ?"
+        params.insert(0, " AND ".join(terms))
+        sql += "".join(f" AND {condition}" for condition in conditions)
+    else:
+        for word in (query or "").split():
+            conditions.append("(a.title LIKE ? OR a.summary LIKE ?)")
+            params += [f"%{word}%", f"%{word}%"]
+        if ticker:
+            conditions.append("(' ' || a.tickers || ' ') LIKE ?")
+            params.append(f"% {ticker.upper()} %")
+        sql = "SELECT a.* FROM articles_archive a" + (" WHERE " + " AND ".join(conditions) if conditions else "")
+    
+    with _state_db_lock:
+        cursor = db.execute(sql + " ORDER BY a.published DESC LIMIT ?", params + [limit])
+        columns = [column[0] for column in cursor.description]
+        return [dict(zip(columns, row)) for row in cursor.fetchall()]
+
+def archive_daily_counts(ticker="*", since=None):
+    """{day: {importance level: articles}} from the precomputed counts"""
+    db = get_state_db()
+    with _state_db_lock:
+        rows = db.execute(
+            "SELECT day, importance, articles FROM archive_daily_counts WHERE ticker = ? AND day >= ? ORDER BY day",
+            (ticker.upper() if ticker != "*" else ticker, since or ""),
+        ).fetchall()
+    counts = {}
+    for day, importance, articles in rows:
+        counts.setdefault(day, {})[importance] = articles
+    return counts
+
+def normalize_title(title):
+    """Headline with accents, case and punctuation removed"""
+    text = unicodedata.normalize("NFKD", title.lower())
+    text = "".join(c if c.isalnum() else " " for c in text if not unicodedata.combining(c))
+    return " ".join(text.split())
+
+def title_shingles(title, size=4):
+    """Character shingles of a normalized headline"""
+    text = normalize_title(title)
+    if len(text) <= size:
+        return {text}
+    return {text[i:i + size] for i in range(len(text) - size + 1)}
+
+def minhash_signature(shingles):
+    """MinHash signature of a shingle set, one value per hash function"""
+    hashed = [zlib.crc32(s.encode("utf-8")) for s in shingles]
+    return [min((a * h + b) % _MINHASH_PRIME for h in hashed) for a, b in _MINHASH_COEFFICIENTS]
+
+def cluster_articles(articles):
+    """Group articles reporting the same story and return one representative per cluster.
+
+    Candidate pairs come from MinHash LSH buckets and from shared company
+    entities, so bucketing is linear in the number of articles; candidates are
+    then confirmed on their exact character and word Jaccard. Articles naming
+    different listed companies are never merged. The representative is the
+    first (most important) member and keeps every member's source link in
+    'sources'.
+    """
+    shingles = [title_shingles(a['title']) for a in articles]
+    words = [set(normalize_title(a['title']).split()) for a in articles]
+    tickers = [set(a.get('tickers', [])) for a in articles]
+    buckets = {}
+    for i, article in enumerate(articles):
+        signature = minhash_signature(shingles[i])
+        for band in range(MINHASH_BANDS):
+            key = ('band', band, tuple(signature[band * MINHASH_ROWS:(band + 1) * MINHASH_ROWS]))
+            buckets.setdefault(key, []).append(i)
+        # Tickers bring together the different names of one company ("bmce", "bank of africa");
+        # sharing a company only proposes a candidate, the match is confirmed like any other
+        for company in set(article.get('tickers', [])) | set(article.get('companies', [])):
+            buckets.setdefault(('company', company), []).append(i)
+    
+    parent = list(range(len(articles)))
+    
+    def similar(i, j):
+        # "Résultats annuels : Attijariwafa bank ..." and "Résultats annuels : CIH Bank ..." are two stories
+        if tickers[i] and tickers[j] and not tickers[i] & tickers[j]:
+            return False
+        union = len(shingles[i] | shingles[j])
+        if not union or len(shingles[i] & shingles[j]) / union < DEDUP_SIMILARITY:
+            return False
+        union = len(words[i] | words[j])
+        return bool(union) and len(words[i] & words[j]) / union >= DEDUP_WORD_SIMILARITY
+    
+    def find(i):
+        while parent[i] != i:
+            parent[i] = parent[parent[i]]
+            i = parent[i]
+        return i
+    
+    checked = set()
+    for members in buckets.values():
+        for x in range(len(members)):
+            for y in range(x + 1, len(members)):
+                i, j = members[x], members[y]
+                if (i, j) in checked or find(i) == find(j):
+                    continue
+                checked.add((i, j))
+                if similar(i, j):
+                    parent[find(j)] = find(i)
+    
+    clusters = {}
+    for i in range(len(articles)):
+        clusters.setdefault(find(i), []).append(i)
+    
+    representatives = []
+    for members in sorted(clusters.values(), key=lambda m: m[0]):
+        representative = dict(articles[members[0]])
+        representative['sources'] = [
+            {'source': articles[i]['source'], 'link': articles[i]['link'], 'title': articles[i]['title']}
+            for i in members
+        ]
+        # The story concerns every company and keyword of its members, for subscription routing
+        for field in ('tickers', 'keywords'):
+            representative[field] = list(dict.fromkeys(tag for i in members for tag in articles[i].get(field, [])))
+        representatives.append(representative)
+    return representatives
+
+def format_source_links(article, extra_sources=None):
+    """Markdown source link(s) of an article, one per source when it was clustered or merged"""
+    sources = article.get('sources') or [{'source': article['source'], 'link': article['link']}]
+    if extra_sources:
+        sources = sources + extra_sources
+    if len(sources) == 1:
+        return f"[المصدر]({sources[0]['link']})"
+    return " ‏".join(f"[{s['source']}]({s['link']})" for s in sources)
+
+def summary_cache_key(article):
+    """Cache key: normalized URL, hash of the text that was summarized and the prompt version"""
+    content = f"{article['title']}\n{article.get('full_text', '')}"
+    if article.get('body'):
+        content += f"\n{article['body']}"
+    content_hash = hashlib.sha256(content.encode("utf-8")).hexdigest()
+    return f"{normalize_article_url(article['link'])}|{content_hash}|v{SUMMARY_PROMPT_VERSION}"
+
+def get_cached_summaries(articles):
+    """Return the cached summary entry of each article, None where it was never summarized"""
+    keys = [summary_cache_key(a) for a in articles]
+    db = get_state_db()
+    with _state_db_lock:
+        db.execute("DELETE FROM summary_cache WHERE created_at < ?", (time.time() - SUMMARY_CACHE_TTL_DAYS * 86400,))
+        db.commit()
+        placeholders = ",".join("?" * len(keys))
+        rows = dict(db.execute(
+            f"SELECT cache_key, entry FROM summary_cache WHERE cache_key IN ({placeholders})", keys
+        ).fetchall())
+    return [json.loads(rows[key]) if key in rows else None for key in keys]
+
+def store_cached_summaries(article_entries):
+    """Cache fresh (article, entry) summaries and keep the cache under its size limit"""
+    if not article_entries:
+        return
+    now = time.time()
+    rows = [(summary_cache_key(a), json.dumps(entry, ensure_ascii=False), now) for a, entry in article_entries]
+    db = get_state_db()
+    with _state_db_lock:
+        db.executemany("INSERT OR REPLACE INTO summary_cache (cache_key, entry, created_at) VALUES (?, ?, ?)", rows)
+        db.execute(
+            "DELETE FROM summary_cache WHERE cache_key NOT IN "
+            "(SELECT cache_key FROM summary_cache ORDER BY created_at DESC LIMIT ?)",
+            (SUMMARY_CACHE_MAX_ENTRIES,),
+        )
+        db.commit()
+
+def get_cached_article_bodies(urls):
+    """Return {normalized url: (body, figures)} for the article pages already downloaded"""
+    db = get_state_db()
+    with _state_db_lock:
+        db.execute("DELETE FROM article_bodies WHERE fetched_at < ?", (time.time() - ARTICLE_BODY_TTL_DAYS * 86400,))
+        db.commit()
+        placeholders = ",".join("?" * len(urls))
+        rows = db.execute(
+            f"SELECT url, body, figures FROM article_bodies WHERE url IN ({placeholders})", urls
+        ).fetchall()
+    return {url: (body, json.loads(figures)) for url, body, figures in rows}
+
+def store_article_bodies(bodies):
+    """Cache {normalized url: (body, figures)}"""
+    now = time.time()
+    rows = [(url, body, json.dumps(figures, ensure_ascii=False), now) for url, (body, figures) in bodies.items()]
+    db = get_state_db()
+    with _state_db_lock:
+        db.executemany("INSERT OR REPLACE INTO article_bodies (url, body, figures, fetched_at) VALUES (?, ?, ?, ?)", rows)
+        db.commit()
+
+def summarize_articles(articles, api_key=GEMINI_API_KEY):
+    """Cluster articles and summarize every story once.
+
+    Returns [(entry, representative), ...] in importance order, without the
+    stories the model merged into another, and whether the model failed for
+    every article.
+    """
+    start = time.perf_counter()
+    
+    # Same story from several sources: only one representative goes to the model
+    articles = cluster_articles(articles)
+    
+    entries = get_cached_summaries(articles)
+    
+    # Articles the model already folded into another cached summary need none of their own
+    covered = {source['link'] for entry in entries if entry for source in entry.get('merged_sources', [])}
     for i, article in enumerate(articles):
-        title_lower = article['title'].lower()
-        for company in LISTED_COMPANIES:
-            if company in title_lower:
-                if company not in companies_mentioned:
-                    companies_mentioned[company] = []
-                companies_mentioned[company].append((i, article))
-    
-    # Prepare articles for Gemini with source info and duplicate detection
+        if entries[i] is None and article['link'] in covered:
+            entries[i] = {'merged_into': article['link']}
+    
+    missing = [i for i in range(len(articles)) if entries[i] is None]
+    print(f"🗃️  Summary cache: {len(articles) - len(missing)} cached, {len(missing)} to summarize")
+    record_count("summary_cache", len(articles) - len(missing), result="hit")
+    record_count("summary_cache", len(missing), result="miss")
+    
+    model_failed = False
+    if missing:
+        generated = summarize_in_chunks([articles[i] for i in missing], api_key)
+        model_failed = all(entry is None for entry in generated) and len(missing) == len(articles)
+        
+        # Only the articles of failed chunks fall back to the generic text
+        new_entries = []
+        for i, entry in zip(missing, generated):
+            if entry is None:
+                entries[i] = fallback_summary_entry(articles[i])
+            else:
+                entries[i] = entry
+                if 'merged_into' not in entry:
+                    new_entries.append((articles[i], entry))
+        store_cached_summaries(new_entries)
+    
+    record_timing("stage_seconds", time.perf_counter() - start, stage="summarize")
+    
+    # Articles are already in importance order; the ones the model merged into another are skipped
+    return [(entry, article) for entry, article in zip(entries, articles) if 'merged_into' not in entry], model_failed
+
+def render_summaries(summaries, model_failed=False):
+    """Digest body of [(entry, article), ...]"""
+    if model_failed:
+        return format_articles_fallback([article for _, article in summaries])
+    return "".join(render_summary_entry(entry, article) for entry, article in summaries)
+
+def estimate_tokens(text):
+    """Rough token count (about 4 characters per token) used for chunk budgeting"""
+    return len(text) // 4 + 1
+
+def chunk_articles_for_gemini(articles):
+    """Split articles into consecutive chunks that fit the per-request token budget"""
+    chunks = []
+    current = []
+    current_tokens = 0
+    for article in articles:
+        tokens = estimate_tokens(
+            f"{article['title']} {article['link']} {article['source']} {article.get('body', '')} {article.get('figures', '')}"
+        ) + GEMINI_ARTICLE_OUTPUT_TOKENS
+        if current and (current_tokens + tokens > GEMINI_CHUNK_TOKEN_BUDGET or len(current) >= GEMINI_MAX_CHUNK_ARTICLES):
+            chunks.append(current)
+            current = []
+            current_tokens = 0
+        current.append(article)
+        current_tokens += tokens
+    if current:
+        chunks.append(current)
+    return chunks
+
+def summarize_in_chunks(articles, api_key=GEMINI_API_KEY):
+    """Summarize token-budgeted chunks concurrently; returns one entry per article, None where its chunk failed"""
+    chunks = chunk_articles_for_gemini(articles)
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=min(GEMINI_MAX_CONCURRENCY, len(chunks))) as executor:
+        results = list(executor.map(lambda chunk: request_gemini_summaries(chunk, api_key), chunks))
+    
+    entries = []
+    failed = 0
+    for chunk, generated in zip(chunks, results):
+        if generated is None:
+            failed += 1
+            generated = [None] * len(chunk)
+        entries.extend(generated)
+    print(f"🤖 Gemini: {len(chunks)} chunk(s) in {time.perf_counter() - start:.2f}s, {failed} failed")
+    return entries
+
+def _retry_delay(response, attempt):
+    """Seconds to wait before retrying: Retry-After when given, exponential backoff otherwise"""
+    retry_after = response.headers.get("Retry-After") if response is not None else None
+    if retry_after and retry_after.isdigit():
+        return float(retry_after)
+    return GEMINI_BACKOFF_SECONDS * (2 ** attempt)
+
+def build_summary_prompt(articles):
+    """Arabic analyst prompt listing the articles to summarize"""
+    # Prepare articles for Gemini with source info
     articles_text = []
     for i, article in enumerate(articles, 1):
-        articles_text.append(f"{i}. {article['title']}\nالمصدر: {article['source']}\nالرابط: {article['link']}")
-    
-    # Add duplicate information to prompt
-    duplicate_info = ""
-    if companies_mentioned:
-        duplicate_info = "\n\nتنبيه مهم: إذا وجدت مقالين أو أكثر يتحدثان عن نفس الشركة أو الموضوع، يرجى دمجهما في ملخص واحد شامل بدلاً من تكرار المعلومات."
+        sources = "، ".join(s['source'] for s in article.get('sources') or [article])
+        entry = f"id={i}. {article['title']}\nالمصدر: {sources}\nالرابط: {article['link']}"
+        if article.get('body'):
+            entry += f"\nمقتطف: {article['body']}"
+        if article.get('figures'):
+            entry += f"\nأرقام: {'، '.join(article['figures'])}"
+        articles_text.append(entry)
     
     prompt = f"""أنت محلل مالي خبير في بورصة الدار البيضاء. إليك {len(articles)} مقال متعلق بالبورصة اليوم:
 
-{chr(10).join(articles_text)}{duplicate_info}
+{chr(10).join(articles_text)}
 
 التعليمات الصارمة:
 1. اكتب ملخصاً أصلياً وفريداً لكل مقال باللغة العربية (ليس إعادة صياغة)
-2. إذا كان هناك مقالان أو أكثر عن نفس الشركة أو الموضوع، ادمجهما في ملخص واحد شامل
+2. إذا كان مقالان يتناولان نفس الخبر، اكتب ملخصاً واحداً وضع أرقام المقالات الأخرى في merged_ids
 3. ركز فقط على التأثير على البورصة والاستثمارات
 4. جملتان قصيرتان كحد أقصى لكل ملخص (أو ثلاث جمل إذا كان مدموج)
-5. استخدم معرفتك المالية لتحليل التأثير المحتمل
+5. استخدم المقتطف والأرقام عند توفرها ومعرفتك المالية لتحليل التأثير المحتمل
 6. اذكر التأثير المحتمل على سعر السهم أو المؤشر
 7. تجنب نسخ المحتوى - أنشئ تحليلاً أصلياً
-8. رتب حسب الأهمية (الأكثر أهمية أولاً)
+8. اربط كل ملخص برقم مقاله في الحقل id
 9. كن مختصراً ومفيداً
 10. لا تضع روابط في الملخص - سيتم إضافتها تلقائياً
 
-تنسيق الإجابة لكل ملخص:
-[الرمز التعبيري] **عنوان قصير (50 حرف كحد أقصى)**
-تحليل أصلي في جملتين كحد أقصى (أو ثلاث إذا كان مدموج).
-
-ابدأ مباشرة بالملخصات، بدون مقدمة."""
+تنسيق الإجابة: مصفوفة JSON فيها كائن لكل ملخص:
+- id: رقم المقال
+- merged_ids: أرقام المقالات المدمجة في هذا الملخص (قائمة فارغة إن لم يوجد)
+- title: عنوان قصير (50 حرف كحد أقصى)
+- summary: تحليل أصلي في جملتين كحد أقصى (أو ثلاث إذا كان مدموج)
+- importance: الأهمية من 1 (عادي) إلى 3 (مهم جداً)"""
+    return prompt
 
-    url = f"https://generativelanguage.googleapis.com/v1beta/models/gemini-1.5-flash:generateContent?key={api_key}"
+def request_gemini_summaries(articles, api_key=GEMINI_API_KEY):
+    """Summarize articles with Gemini; returns one entry per article (None if unanswered), or None on failure"""
+    prompt = build_summary_prompt(articles)
+    url = f"{GEMINI_API_URL}?key={api_key}"
     headers = {"Content-Type": "application/json"}
     data = {
         "contents": [
@@ -360,81 +1959,113 @@ def summarize_articles_with_gemini(articles, api_key=GEMINI_API_KEY):
                     {"text": prompt}
                 ]
             }
-        ]
+        ],
+        "generationConfig": {
+            "responseMimeType": "application/json",
+            "responseSchema": GEMINI_SUMMARY_SCHEMA,
+        },
     }
 
     try:
-        response = requests.post(url, headers=headers, json=data, timeout=30)
+        for attempt in range(GEMINI_MAX_RETRIES + 1):
+            response = None
+            request_start = time.perf_counter()
+            try:
+                response = get_session(url).post(url, headers=headers, json=data, timeout=GEMINI_TIMEOUT)
+            except requests.RequestException as e:
+                record_timing("gemini_request_seconds", time.perf_counter() - request_start, status="error")
+                if attempt == GEMINI_MAX_RETRIES:
+                    raise
+                print(f"⚠️  Gemini request failed ({e}) - retrying")
+            else:
+                record_timing("gemini_request_seconds", time.perf_counter() - request_start,
+                              status=response.status_code)
+                # Rate limited or server error: back off and retry
+                if response.status_code != 429 and response.status_code < 500:
+                    break
+                if attempt == GEMINI_MAX_RETRIES:
+                    break
+                print(f"⚠️  Gemini HTTP {response.status_code} - retrying")
+            time.sleep(_retry_delay(response, attempt))
         
         if response.status_code != 200:
             print("❌ Gemini API error:", response.text)
-            return format_articles_fallback(articles)
+            return None
         
         result = response.json()
+        record_gemini_usage(result.get("usageMetadata", {}))
         
         if "candidates" not in result or not result["candidates"]:
             print("❌ No candidates in Gemini response")
-            return format_articles_fallback(articles)
-            
-        # Add RTL formatting and links to the generated content
-        gemini_content = result["candidates"][0]["content"]["parts"][0]["text"]
+            return None
         
-        # Process the content and add sources at the end of each summary
-        formatted_content = ""
-        lines = gemini_content.split('\n')
-        article_index = 0
-        current_summary = []
-        
-        for line in lines:
-            line = line.strip()
-            if not line:
-                continue
-                
-            if (line.startswith('🚨') or line.startswith('📈') or line.startswith('📊')) and '**' in line:
-                # This is a title line with emoji
-                if current_summary and article_index > 0:
-                    # Finish previous article
-                    summary_text = ' '.join(current_summary)
-                    if not summary_text.endswith('.'):
-                        summary_text += '.'
-                    # Use invisible character to prevent link preview compression
-                    formatted_content += f"‏{summary_text} 📰 ‏[المصدر]({articles[min(article_index-1, len(articles)-1)]['link']})\n\n"
-                    current_summary = []
-                
-                # Start new article
-                formatted_content += f"‏{line}\n"
-                article_index += 1
-            elif line.startswith('**') and line.endswith('**'):
-                # This is a title line without emoji
-                if current_summary and article_index > 0:
-                    # Finish previous article
-                    summary_text = ' '.join(current_summary)
-                    if not summary_text.endswith('.'):
-                        summary_text += '.'
-                    # Use invisible character to prevent link preview compression
-                    formatted_content += f"‏{summary_text} 📰 ‏[المصدر]({articles[min(article_index-1, len(articles)-1)]['link']})\n\n"
-                    current_summary = []
-                
-                # Start new article
-                formatted_content += f"‏{line}\n"
-                article_index += 1
-            else:
-                # This is content
-                current_summary.append(line)
-        
-        # Don't forget the last article
-        if current_summary and article_index > 0:
-            summary_text = ' '.join(current_summary)
-            if not summary_text.endswith('.'):
-                summary_text += '.'
-            # Use invisible character to prevent link preview compression
-            formatted_content += f"‏{summary_text} 📰 ‏[المصدر]({articles[min(article_index-1, len(articles)-1)]['link']})\n\n"
-        
-        return formatted_content
+        return parse_gemini_summaries(result["candidates"][0]["content"]["parts"][0]["text"], articles)
         
     except Exception as e:
         print(f"❌ Gemini error: {e}")
-        return format_articles_fallback(articles)
+        return None
+
+def record_gemini_usage(usage):
+    """Count the tokens Gemini reports for one answer"""
+    for field, kind in (("promptTokenCount", "prompt"), ("candidatesTokenCount", "output"), ("totalTokenCount", "total")):
+        if field in usage:
+            record_count("gemini_tokens", usage[field], kind=kind)
+
+def parse_gemini_summaries(gemini_content, articles):
+    """Map the model's JSON answer onto articles by id.
+
+    Returns one entry per article: {'title', 'summary', 'importance'} for the
+    article a summary belongs to (with 'merged_sources' when other articles
+    were folded into it), {'merged_into': id} for those folded articles and
+    None for articles the model skipped. An article the model both summarized
+    and merged into another keeps its own summary, whatever the answer order.
+    """
+    items = {}
+    for item in json.loads(gemini_content):
+        index = item.get('id', 0) - 1
+        if 0 <= index < len(articles) and item.get('summary') and index not in items:
+            items[index] = item
+    
+    entries = [None] * len(articles)
+    for index, item in items.items():
+        summary_text = item['summary'].strip()
+        if not summary_text.endswith('.'):
+            summary_text += '.'
+        entry = {'title': item.get('title', '').strip() or articles[index]['title'][:70], 'summary': summary_text,
+                 'importance': item.get('importance')}
+        
+        # Each article is shown once: not merged when summarized on its own or already merged elsewhere
+        merged = [
+            m for m in dict.fromkeys(m - 1 for m in item.get('merged_ids') or [])
+            if 0 <= m < len(articles) and m not in items and entries[m] is None
+        ]
+        if merged:
+            entry['merged_sources'] = [
+                source for m in merged
+                for source in articles[m].get('sources') or [{'source': articles[m]['source'], 'link': articles[m]['link']}]
+            ]
+        entries[index] = entry
+        for m in merged:
+            entries[m] = {'merged_into': index + 1}
+    return entries
+
+def fallback_summary_entry(article):
+    """Summary entry used when the model could not summarize an article"""
+    title = article['title'][:70] + ('...' if len(article['title']) > 70 else '')
+    return {
+        'title': title,
+        'summary': "شركة مدرجة في البورصة مع تأثير محتمل على الأسعار.",
+        'importance': article['importance']['level'],
+    }
+
+def render_summary_entry(entry, article):
+    """Format one summary with its source link(s) for Telegram"""
+    links = format_source_links(article, entry.get('merged_sources'))
+    # Use invisible character to prevent link preview compression
+    return (
+        f"‏{article['importance']['emoji']} **{entry['title']}**\n"
+        f"‏{entry['summary']} 📰 ‏{links}\n\n"
+    )
 
 def format_articles_fallback(articles):
     """Fallback formatting if Gemini fails - in Arabic with RTL"""
@@ -444,91 +2075,432 @@ def format_articles_fallback(articles):
     formatted = f"‏📈 *بورصة الدار البيضاء - {len(articles)} أخبار اليوم*\n\n"
     
     for article in articles:
-        title = article['title'][:70] + ('...' if len(article['title']) > 70 else '')
-        formatted += f"‏{article['importance']['emoji']} **{title}**\n"
-        formatted += f"‏شركة مدرجة في البورصة مع تأثير محتمل على الأسعار. 📰 [المصدر]({article['link']})\n\n"
+        formatted += render_summary_entry(fallback_summary_entry(article), article)
     
     return formatted
 
-def send_to_telegram(text):
-    url = f"https://api.telegram.org/bot{BOT_TOKEN}/sendMessage"
+def markdown_to_telegram_html(text):
+    """Convert the digest's **bold** / *bold* / [text](url) markup to escaped Telegram HTML"""
+    # Links are found on the raw text so their text and URL are escaped exactly once;
+    # they stand in as placeholders while the bold markup is converted
+    links, parts, end = [], [], 0
+    for match in _MARKDOWN_LINK_RE.finditer(text):
+        parts.append(html.escape(text[end:match.start()], quote=False))
+        parts.append(f"\x00{len(links)}\x00")
+        links.append(f'<a href="{html.escape(match.group(2))}">{html.escape(match.group(1), quote=False)}</a>')
+        end = match.end()
+    parts.append(html.escape(text[end:], quote=False))
+    escaped = _MARKDOWN_BOLD_RE.sub(r"<b>\1</b>", "".join(parts))
+    escaped = _MARKDOWN_SINGLE_BOLD_RE.sub(r"<b>\1</b>", escaped)
+    return _LINK_PLACEHOLDER_RE.sub(lambda m: links[int(m.group(1))], escaped)
+
+def _split_escaped(text, limit):
+    """Cut plain text into (html, plain) pieces whose escaped HTML fits in limit characters"""
+    pieces, start, size = [], 0, 0
+    for i, char in enumerate(text):
+        char_size = len(html.escape(char, quote=False))
+        if size + char_size > limit:
+            pieces.append((html.escape(text[start:i], quote=False), text[start:i]))
+            start, size = i, 0
+        size += char_size
+    if start < len(text):
+        pieces.append((html.escape(text[start:], quote=False), text[start:]))
+    return pieces
+
+def markdown_to_plain_text(text):
+    """Last-resort rendering without any parse mode"""
+    text = _MARKDOWN_LINK_RE.sub(r"\1 (\2)", text)
+    return text.replace("**", "").replace("*", "")
+
+def split_telegram_message(text, limit=TELEGRAM_MESSAGE_LIMIT):
+    """Split a digest on summary boundaries into messages of at most limit characters.
+
+    Returns (html, plain) pairs: the Telegram HTML message and its plain-text
+    equivalent used if Telegram rejects the markup.
+    """
+    messages = []
+    current_html, current_plain = "", ""
+    for block in (block for block in text.split("\n\n") if block.strip()):
+        block_html = markdown_to_telegram_html(block)
+        if len(block_html) <= limit:
+            pieces = [(block_html, markdown_to_plain_text(block))]
+        else:
+            # A single oversized summary: fall back to line, then hard character boundaries
+            pieces = []
+            for line in block.split("\n"):
+                line_html = markdown_to_telegram_html(line)
+                if len(line_html) <= limit:
+                    pieces.append((line_html, markdown_to_plain_text(line)))
+                else:
+                    pieces.extend(_split_escaped(markdown_to_plain_text(line), limit))
+        
+        for piece_html, piece_plain in pieces:
+            if not current_html:
+                current_html, current_plain = piece_html, piece_plain
+            elif len(current_html) + 2 + len(piece_html) <= limit:
+                current_html += "\n\n" + piece_html
+                current_plain += "\n\n" + piece_plain
+            else:
+                messages.append((current_html, current_plain))
+                current_html, current_plain = piece_html, piece_plain
+    if current_html:
+        messages.append((current_html, current_plain))
+    return messages
+
+def _send_telegram_message(chat_id, html_text, plain_text):
+    """Send one message, honouring rate limits and retry_after; returns True on success"""
+    url = f"{TELEGRAM_API_URL}/bot{BOT_TOKEN}/sendMessage"
     payload = {
-        "chat_id": CHAT_ID,
-        "text": text,
-        "parse_mode": "Markdown",  # Enable markdown for formatting
+        "chat_id": chat_id,
+        "text": html_text,
+        "parse_mode": "HTML",
         "disable_web_page_preview": True,  # Disable link previews to prevent compression
         "disable_notification": False  # Keep notifications enabled
     }
     
-    try:
-        response = requests.post(url, data=payload, timeout=15)
+    for attempt in range(TELEGRAM_MAX_RETRIES + 1):
+        # Telegram allows ~30 messages/s overall and ~1 message/s per chat
+        _wait_for_politeness_slot("telegram", 1.0 / TELEGRAM_GLOBAL_RATE)
+        _wait_for_politeness_slot(f"telegram:{chat_id}", TELEGRAM_PER_CHAT_INTERVAL)
+        send_start = time.perf_counter()
+        try:
+            response = get_session(url).post(url, data=payload, timeout=15)
+        except requests.RequestException as e:
+            record_timing("telegram_send_seconds", time.perf_counter() - send_start, status="error")
+            print(f"❌ Error sending to Telegram chat {chat_id}: {e}")
+            continue
+        record_timing("telegram_send_seconds", time.perf_counter() - send_start, status=response.status_code)
+        
         if response.status_code == 200:
-            print("✅ Message sent to Telegram successfully!")
+            record_count("telegram_messages", outcome="sent")
             return True
+        
+        try:
+            error = response.json()
+        except ValueError:
+            error = {}
+        description = str(error.get("description", response.text))
+        
+        if response.status_code == 429:
+            retry_after = error.get("parameters", {}).get("retry_after", 1)
+            print(f"⏳ Telegram rate limit for chat {chat_id} - waiting {retry_after}s")
+            time.sleep(retry_after)
+        elif response.status_code == 400 and "parse" in description.lower() and "parse_mode" in payload:
+            # Broken entities: resend the same content as plain text
+            print("🔄 Retrying without formatting...")
+            del payload["parse_mode"]
+            payload["text"] = plain_text
         else:
             print(f"❌ Telegram API error: {response.status_code}")
-            print("Response:", response.text)
-            
-            # If markdown fails, try with HTML parse mode
-            if "parse_mode" in str(response.text).lower():
-                print("🔄 Retrying with HTML parse mode...")
-                payload["parse_mode"] = "HTML"
-                # Convert markdown to HTML for links
-                html_text = text.replace("[المصدر]", "<a href='#'>المصدر</a>")
-                html_text = re.sub(r'\[([^\]]+)\]\(([^)]+)\)', r'<a href="\2">\1</a>', html_text)
-                payload["text"] = html_text
-                
-                response = requests.post(url, data=payload, timeout=15)
-                if response.status_code == 200:
-                    print("✅ Message sent with HTML formatting!")
-                    return True
-            
+            print("Response:", description)
+            record_count("telegram_messages", outcome="failed")
             return False
-    except Exception as e:
-        print(f"❌ Error sending to Telegram: {e}")
+    record_count("telegram_messages", outcome="failed")
+    return False
+
+def _deliver_to_chat(chat_id, messages):
+    """Send queued messages to one chat in order; stops at the first failure"""
+    for html_text, plain_text in messages:
+        if not _send_telegram_message(chat_id, html_text, plain_text):
+            return False
+    return True
+
+def deliver_messages(deliveries, required=None):
+    """Deliver {chat_id: [digest text, ...]} with one ordered queue per chat, chats served concurrently.
+
+    Returns True when every chat of required (default: every chat) got all its messages.
+    """
+    # Subscribers with the same filters get the same digest: split it once
+    splits = {}
+    queues = {}
+    for chat_id, texts in deliveries.items():
+        queues[chat_id] = []
+        for text in texts:
+            if text not in splits:
+                splits[text] = split_telegram_message(text)
+            queues[chat_id].extend(splits[text])
+    if not queues:
+        print("⚠️  No Telegram chat configured")
         return False
+    
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=min(TELEGRAM_MAX_CONCURRENT_CHATS, len(queues))) as executor:
+        results = dict(zip(queues, executor.map(lambda item: _deliver_to_chat(*item), queues.items())))
+    record_timing("stage_seconds", time.perf_counter() - start, stage="deliver")
+    
+    sent = sum(len(queues[chat_id]) for chat_id, ok in results.items() if ok)
+    print(f"📨 Telegram: {sent} message(s) delivered to {sum(results.values())}/{len(results)} chat(s)")
+    return all(results.get(chat_id, False) for chat_id in (required or results))
 
-if __name__ == "__main__":
+def send_to_telegram(text, chat_ids=None):
+    """Send a digest to every configured chat, split to Telegram's size limit"""
+    chat_ids = CHAT_IDS if chat_ids is None else chat_ids
+    success = deliver_messages({chat_id: [text] for chat_id in chat_ids})
+    if success:
+        print("✅ Message sent to Telegram successfully!")
+    return success
+
+def build_deliveries(summaries, model_failed, header):
+    """{chat_id: [text]}: the whole digest for CHAT_IDS, and for each subscriber the stories it follows.
+
+    Every story is summarized once; subscribers with the same selection share one rendered text.
+    """
+    deliveries = {chat_id: [header + render_summaries(summaries, model_failed)] for chat_id in CHAT_IDS}
+    
+    rendered = {}
+    routes = route_to_subscribers([article for _, article in summaries])
+    for chat_id, indices in routes.items():
+        if chat_id in deliveries:
+            continue
+        selection = tuple(indices)
+        if selection not in rendered:
+            rendered[selection] = header + render_summaries([summaries[i] for i in selection], model_failed)
+        deliveries[chat_id] = [rendered[selection]]
+    if routes:
+        print(f"🔔 Subscriptions: {len(routes)} subscriber(s), {len(rendered)} distinct digest(s)")
+    return deliveries
+
+def build_digest(articles):
+    """Summarize articles into the daily digest.
+
+    Returns (summaries, model_failed, deliveries) as given by summarize_articles
+    and build_deliveries.
+    """
+    # Header only (no footer) with RTL formatting
+    today = market_now().strftime("%d %B %Y")
+    header = f"‏🏛️ **بورصة الدار البيضاء** - {today}\n\n"
+    summaries, model_failed = summarize_articles(articles)
+    return summaries, model_failed, build_deliveries(summaries, model_failed, header)
+
+def print_importance_breakdown(articles):
+    high_imp = sum(1 for a in articles if a['importance']['level'] == 3)
+    med_imp = sum(1 for a in articles if a['importance']['level'] == 2)
+    low_imp = sum(1 for a in articles if a['importance']['level'] == 1)
+    
+    print(f"🚨 Très Important: {high_imp}")
+    print(f"📈 Important: {med_imp}")
+    print(f"📊 Standard: {low_imp}")
+
+def send_digest(articles):
+    """Send the digest (or the no-news message) and record the run on success; returns True if delivered"""
+    if not articles:
+        message = "📭 لا توجد أخبار متعلقة ببورصة الدار البيضاء اليوم."
+        success = send_to_telegram(message)
+        if success:
+            commit_run_state(articles)
+        print("📭 No strict stock market articles found for today")
+        return success
+    
+    print(f"\n📈 Processing {len(articles)} strict stock market articles...")
+    
+    # Send to Telegram: the configured chats decide success, subscriber failures are only reported
+    summaries, model_failed, deliveries = build_digest(articles)
+    success = deliver_messages(deliveries, required=CHAT_IDS)
+    
+    if success:
+        commit_run_state(articles)
+        # Generic fallback texts are not worth keeping as summaries
+        archive_articles(articles, [] if model_failed else summaries)
+        print("✅ Arabic stock market summary sent successfully!")
+        print(f"📊 Summary included {len(articles)} articles")
+        
+        # Show importance breakdown
+        print_importance_breakdown(articles)
+    else:
+        print("❌ Failed to send message")
+    return success
+
+def run_once():
+    """One-shot run used by the daily cron job"""
+    try:
+        # Get today's STRICT stock market articles
+        send_digest(get_today_articles())
+    finally:
+        write_run_report()
+
+def send_instant_alerts(alerts):
+    """Push level-3 articles right away instead of waiting for the digest"""
+    header = "‏🚨 **تنبيه عاجل - بورصة الدار البيضاء**\n\n"
+    summaries, model_failed = summarize_articles(alerts)
+    success = deliver_messages(build_deliveries(summaries, model_failed, header), required=CHAT_IDS)
+    if success:
+        archive_articles(alerts, [] if model_failed else summaries)
+    return success
+
+def is_market_open(now_local):
+    """Casablanca Stock Exchange continuous session, Monday to Friday"""
+    return now_local.weekday() < 5 and MARKET_OPEN <= now_local.time() < MARKET_CLOSE
+
+def next_poll_delay(now_local, digest_at):
+    """Seconds until the next poll: tight during the session, relaxed otherwise, never past the open or the digest"""
+    if is_market_open(now_local):
+        return MARKET_POLL_SECONDS
+    
+    wake_ups = [digest_at]
+    next_open = now_local.replace(hour=MARKET_OPEN.hour, minute=MARKET_OPEN.minute, second=0, microsecond=0)
+    while next_open <= now_local or next_open.weekday() >= 5:
+        next_open += timedelta(days=1)
+    wake_ups.append(next_open)
+    
+    until_wake_up = min((w - now_local).total_seconds() for w in wake_ups if w > now_local)
+    return max(1, min(OFF_HOURS_POLL_SECONDS, until_wake_up))
+
+def next_digest_time(now_local):
+    """Next local datetime at which the daily digest is due"""
+    digest_at = now_local.replace(hour=DIGEST_TIME.hour, minute=DIGEST_TIME.minute, second=0, microsecond=0)
+    if digest_at <= now_local:
+        digest_at += timedelta(days=1)
+    return digest_at
+
+def run_daemon():
+    """Poll sources continuously, alert on level-3 news and send the rest as a daily digest.
+
+    Sessions, the cloudscraper challenge and extractor selectors stay in memory
+    between polls. The pending digest is also persisted in the state database,
+    since the validators of its pages are committed before it is delivered.
+    """
+    print(f"🛰️  Daemon mode: every {MARKET_POLL_SECONDS}s during market hours, "
+          f"{OFF_HOURS_POLL_SECONDS}s otherwise, digest at {DIGEST_TIME:%H:%M} ({MARKET_TIMEZONE.key})")
+    start_metrics_server()
+    pending = load_pending_articles()  # normalized URL -> article waiting for the next digest
+    if pending:
+        print(f"📥 {len(pending)} article(s) still pending from the previous run")
+    digest_at = next_digest_time(datetime.now(MARKET_TIMEZONE))
+    digest_retry = DIGEST_RETRY_SECONDS
+    
+    while True:
+        try:
+            articles = get_today_articles()
+            new_articles = [a for a in articles if normalize_article_url(a['link']) not in pending]
+            alerts = [a for a in new_articles if a['importance']['level'] >= ALERT_IMPORTANCE_LEVEL]
+            
+            if alerts:
+                print(f"\n🚨 {len(alerts)} instant alert(s)")
+                if send_instant_alerts(alerts):
+                    mark_articles_seen(alerts)
+                else:
+                    # Not delivered: keep them for the digest instead of losing them
+                    alerts = []
+            queued = [a for a in new_articles if a not in alerts]
+            for article in queued:
+                pending[normalize_article_url(article['link'])] = article
+            # Pages parsed this poll are either delivered or queued in the state database
+            queue_pending_articles(queued)
+            commit_http_cache()
+            
+            now_local = datetime.now(MARKET_TIMEZONE)
+            if now_local >= digest_at:
+                digest_articles = sorted(pending.values(), key=lambda x: (x['importance']['level'], x['published']), reverse=True)
+                if send_digest(digest_articles):
+                    pending.clear()
+                    clear_pending_articles()
+                    digest_at = next_digest_time(now_local)
+                    digest_retry = DIGEST_RETRY_SECONDS
+                else:
+                    # Retry soon rather than tomorrow, when most of the digest would be stale
+                    digest_at = now_local + timedelta(seconds=digest_retry)
+                    print(f"🔁 Digest retry in {digest_retry}s")
+                    digest_retry = min(digest_retry * 2, OFF_HOURS_POLL_SECONDS)
+        except Exception as e:
+            # Keep the daemon alive; the next poll retries
+            print(f"❌ Poll failed: {e}")
+            record_count("daemon_polls", outcome="failed")
+        else:
+            record_count("daemon_polls", outcome="ok")
+        write_run_report()
+        
+        now_local = datetime.now(MARKET_TIMEZONE)
+        delay = next_poll_delay(now_local, digest_at)
+        print(f"💤 Next poll in {delay:.0f}s ({'market open' if is_market_open(now_local) else 'market closed'}, "
+              f"{len(pending)} pending for the digest)")
+        time.sleep(delay)
+
+def manage_subscriptions(args):
+    """subscribe / unsubscribe / subscriptions commands"""
+    if args.command == "subscribe":
+        for topic in args.topics:
+            try:
+                kind, value = add_subscription(args.chat_id, topic, args.min_importance)
+            except ValueError as e:
+                print(f"❌ {e}")
+                continue
+            print(f"🔔 {args.chat_id} follows {kind} {value} (importance >= {args.min_importance})")
+    elif args.command == "unsubscribe":
+        removed = 0
+        for topic in args.topics or [None]:
+            try:
+                removed += remove_subscriptions(args.chat_id, topic)
+            except ValueError as e:
+                print(f"❌ {e}")
+        print(f"🔕 {removed} subscription(s) removed for {args.chat_id}")
+    elif args.command == "subscriptions":
+        rows = list_subscriptions(args.chat_id)
+        for chat_id, kind, value, min_importance in rows:
+            print(f"{chat_id}\t{kind}\t{value}\timportance >= {min_importance}")
+        print(f"📋 {len(rows)} subscription(s)")
+
+def query_archive(args):
+    """search / stats commands"""
+    since = (market_now() - timedelta(days=args.days)).strftime("%Y-%m-%d") if args.days else None
+    if args.command == "search":
+        results = search_archive(" ".join(args.query), args.ticker, since, args.limit)
+        for article in results:
+            emoji = {3: '🚨', 2: '📈'}.get(article['importance'], '📊')
+            tickers = f" [{article['tickers']}]" if article['tickers'] else ""
+            print(f"{article['published'][:16].replace('T', ' ')} {emoji} {article['title']}{tickers}")
+            print(f"    {article['source']}: {article['link']}")
+        print(f"🔎 {len(results)} article(s)")
+    else:
+        counts = archive_daily_counts(args.ticker or "*", since)
+        print("day         total  🚨  📈  📊")
+        for day, levels in counts.items():
+            print(f"{day}  {sum(levels.values()):>5} {levels.get(3, 0):>3} {levels.get(2, 0):>3} {levels.get(1, 0):>3}")
+        print(f"📊 {sum(sum(levels.values()) for levels in counts.values())} article(s) over {len(counts)} day(s)")
+
+def main():
+    parser = argparse.ArgumentParser(description="Casablanca stock market news bot")
+    parser.add_argument("--daemon", action="store_true", help="poll continuously with instant alerts instead of a one-shot run")
+    commands = parser.add_subparsers(dest="command")
+    subscribe = commands.add_parser("subscribe", help="route articles about tickers, companies or keywords to a chat")
+    subscribe.add_argument("chat_id")
+    subscribe.add_argument("topics", nargs="+", help='ticker (ATW), ISIN, company alias, market keyword or "all"')
+    subscribe.add_argument("--min-importance", type=int, choices=(1, 2, 3), default=1)
+    unsubscribe = commands.add_parser("unsubscribe", help="remove some or all subscriptions of a chat")
+    unsubscribe.add_argument("chat_id")
+    unsubscribe.add_argument("topics", nargs="*")
+    listing = commands.add_parser("subscriptions", help="list subscriptions")
+    listing.add_argument("chat_id", nargs="?")
+    search = commands.add_parser("search", help="search the article archive")
+    search.add_argument("query", nargs="*", help="words that must all appear in the title or summary")
+    search.add_argument("--limit", type=int, default=20)
+    stats = commands.add_parser("stats", help="daily article counts from the archive")
+    for command in (search, stats):
+        command.add_argument("--ticker")
+        command.add_argument("--days", type=int, default=None, help="only the last N days")
+    args = parser.parse_args()
+    
+    if args.command in ("search", "stats"):
+        query_archive(args)
+        return
+    if args.command:
+        manage_subscriptions(args)
+        return
+    
     try:
         print("🎯 STRICT CASABLANCA STOCK MARKET & IPO NEWS BOT")
         print("=" * 60)
         
-        # Get today's STRICT stock market articles
-        articles = get_today_articles()
-        
-        if not articles:
-            message = "📭 لا توجد أخبار متعلقة ببورصة الدار البيضاء اليوم."
-            send_to_telegram(message)
-            print("📭 No strict stock market articles found for today")
+        if args.daemon:
+            run_daemon()
         else:
-            print(f"\n📈 Processing {len(articles)} strict stock market articles...")
-            
-            # Create enhanced Arabic summary with Gemini
-            summary = summarize_articles_with_gemini(articles)
-            
-            # Add header only (no footer) with RTL formatting
-            today = datetime.now().strftime("%d %B %Y")
-            final_message = f"‏🏛️ **بورصة الدار البيضاء** - {today}\n\n{summary}"
-            
-            # Send to Telegram
-            success = send_to_telegram(final_message)
-            
-            if success:
-                print("✅ Arabic stock market summary sent successfully!")
-                print(f"📊 Summary included {len(articles)} articles")
-                
-                # Show importance breakdown
-                high_imp = sum(1 for a in articles if a['importance']['level'] == 3)
-                med_imp = sum(1 for a in articles if a['importance']['level'] == 2)
-                low_imp = sum(1 for a in articles if a['importance']['level'] == 1)
-                
-                print(f"🚨 Très Important: {high_imp}")
-                print(f"📈 Important: {med_imp}")
-                print(f"📊 Standard: {low_imp}")
-            else:
-                print("❌ Failed to send message")
-            
+            run_once()
+    
+    except KeyboardInterrupt:
+        print("👋 Stopped")
     except Exception as e:
         error_message = f"‏❌ خطأ في البوت: {str(e)}"
         print(error_message)
-        send_to_telegram(error_message) 
+        send_to_telegram(error_message)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,20 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import news_bot  # noqa: E402
+
+
+@pytest.fixture
+def state_db(tmp_path, monkeypatch):
+    """A fresh state database under tmp_path in place of STATE_DB_PATH"""
+    monkeypatch.setattr(news_bot, "STATE_DB_PATH", str(tmp_path / "bot_state.db"))
+    monkeypatch.setattr(news_bot, "_state_db", None)
+    monkeypatch.setattr(news_bot, "_pending_http_cache", [])
+    news_bot.invalidate_subscription_index()
+    db = news_bot.get_state_db()
+    yield db
+    db.close()
+    news_bot.invalidate_subscription_index()
@@ -0,0 +1,166 @@
+"""Behavior tests of the pure helpers: date parsing, keyword matching, dedup and message splitting.
+
+Run from the repository root:
+
+    python -m pytest -q tests
+"""
+import html
+import json
+import os
+import sys
+from datetime import datetime
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import news_bot  # noqa: E402
+
+NOW = datetime(2025, 3, 5, 10)
+
+
+def article(title, tickers=(), source="BourseNews"):
+    return {'title': title, 'link': f"https://example.ma/{abs(hash(title))}", 'source': source,
+            'tickers': list(tickers), 'keywords': []}
+
+
+@pytest.mark.parametrize("text, expected, has_time", [
+    ("Publié le 1er mars 2025 à 14h30", datetime(2025, 3, 1, 14, 30), True),
+    ("Mercredi 5 Mars 2025", datetime(2025, 3, 5), False),
+    ("05/03/2025 10:30", datetime(2025, 3, 5, 10, 30), True),
+    ("il y a 3 heures", datetime(2025, 3, 5, 7), True),
+    ("il y a une minute", datetime(2025, 3, 5, 9, 59), True),
+    ("il y a 2h", datetime(2025, 3, 5, 8), True),
+    ("il y a 30min", datetime(2025, 3, 5, 9, 30), True),
+    ("hier à 18h05", datetime(2025, 3, 4, 18, 5), True),
+    ("Aujourd'hui 09:15", datetime(2025, 3, 5, 9, 15), True),
+])
+def test_parse_french_datetime(text, expected, has_time):
+    assert news_bot.parse_french_datetime(text, NOW) == (expected, has_time)
+
+
+@pytest.mark.parametrize("text", ["Cahier des charges", "Hierarchie des normes", "Le fichier est en ligne", ""])
+def test_parse_french_datetime_ignores_words_containing_hier(text):
+    assert news_bot.parse_french_datetime(text, NOW) == (None, False)
+
+
+def test_parse_french_datetime_prefers_explicit_date():
+    parsed, _ = news_bot.parse_french_datetime("Fichier des actionnaires publié 12 janvier 2024", NOW)
+    assert parsed == datetime(2024, 1, 12)
+    parsed, _ = news_bot.parse_french_datetime("Mis à jour hier - 2 mars 2025", NOW)
+    assert parsed == datetime(2025, 3, 2)
+
+
+def test_parse_feed_uses_casablanca_time():
+    # Summer 2024: Casablanca is UTC+1, whatever the zone of the host running the bot
+    feed = b"""<rss><channel><item>
+        <title>Attijariwafa bank : dividende en hausse, cours de bourse au plus haut</title>
+        <link>https://medias24.com/2024/07/01/attijariwafa-dividende/</link>
+        <pubDate>Mon, 01 Jul 2024 13:30:00 GMT</pubDate>
+    </item></channel></rss>"""
+    source = news_bot.SOURCES["medias24.com"]
+    articles = news_bot.parse_feed(source, source.listing_urls[0], feed, datetime(2024, 7, 1, 15))
+    assert [a['published'] for a in articles] == [datetime(2024, 7, 1, 14, 30)]
+
+
+def test_parse_french_datetime_invalid_date():
+    assert news_bot.parse_french_datetime("31/02/2025", NOW) == (None, False)
+
+
+def test_match_keywords_categories():
+    hits = news_bot.match_keywords("Attijariwafa bank : suspension de cotation à la Bourse de Casablanca")
+    assert "suspension de cotation" in hits['high']
+    assert "bourse de casablanca" in hits['stock']
+    assert "attijariwafa bank" in hits['company']
+    assert news_bot.company_tickers(hits['company']) == ["ATW"]
+
+
+def test_match_keywords_whole_words_only():
+    hits = news_bot.match_keywords("Le cahier des charges d'Attijariwafabank")
+    assert all(not keywords for keywords in hits.values())
+
+
+def test_match_keywords_alias_maps_to_ticker():
+    hits = news_bot.match_keywords("BMCE et Bank of Africa, même groupe")
+    assert news_bot.company_tickers(hits['company']) == ["BOA"]
+
+
+def test_cluster_articles_merges_same_story():
+    clusters = news_bot.cluster_articles([
+        article("Attijariwafa bank : hausse de 12% du résultat net", ["ATW"]),
+        article("Le résultat net d'Attijariwafa bank en hausse de 12%", ["ATW"], source="Medias24"),
+    ])
+    assert len(clusters) == 1
+    assert [s['source'] for s in clusters[0]['sources']] == ["BourseNews", "Medias24"]
+
+
+def test_cluster_articles_keeps_different_stories_of_one_company():
+    clusters = news_bot.cluster_articles([
+        article("Attijariwafa bank lance une augmentation de capital", ["ATW"]),
+        article("Attijariwafa bank ouvre une filiale au Sénégal", ["ATW"]),
+    ])
+    assert len(clusters) == 2
+
+
+def test_cluster_articles_keeps_different_companies_apart():
+    clusters = news_bot.cluster_articles([
+        article("Résultats annuels 2024 : Attijariwafa bank en hausse de 12%", ["ATW"]),
+        article("Résultats annuels 2024 : CIH Bank en hausse de 8%", ["CIH"]),
+    ])
+    assert len(clusters) == 2
+
+
+def test_markdown_to_telegram_html_escapes_links_once():
+    converted = news_bot.markdown_to_telegram_html("**A & B** [R&D](https://example.ma/?a=1&b=2)")
+    assert converted == '<b>A &amp; B</b> <a href="https://example.ma/?a=1&amp;b=2">R&amp;D</a>'
+
+
+def test_split_telegram_message_respects_limit_after_escaping():
+    text = "**Titre**\n\n" + "x & y < z " * 2000
+    messages = news_bot.split_telegram_message(text)
+    assert len(messages) > 1
+    assert all(len(message_html) <= news_bot.TELEGRAM_MESSAGE_LIMIT for message_html, _ in messages)
+    assert "&amp;amp;" not in "".join(message_html for message_html, _ in messages)
+    assert all(html.unescape(message_html) == plain for message_html, plain in messages[1:])
+
+
+def test_split_telegram_message_keeps_summaries_whole():
+    blocks = [f"**{i}** [source](https://example.ma/{i}?a=1&b=2)" for i in range(400)]
+    messages = news_bot.split_telegram_message("\n\n".join(blocks))
+    assert all(len(message_html) <= news_bot.TELEGRAM_MESSAGE_LIMIT for message_html, _ in messages)
+    assert sum(message_html.count("<a href=") for message_html, _ in messages) == 400
+
+
+def test_protected_source_reads_feeds_without_cloudscraper(monkeypatch):
+    fetched = []
+
+    def fetch_listing_pages(jobs):
+        fetched.extend(jobs)
+        return [{'base_url': base_url, 'page': page, 'url': source.page_url(base_url, page), 'response': None,
+                 'error': "HTTP 503", 'elapsed': 0.0, 'not_modified': False, 'cache_entry': None}
+                for source, base_url, page in jobs]
+    monkeypatch.setattr(news_bot, "CLOUDSCRAPER_AVAILABLE", False)
+    monkeypatch.setattr(news_bot, "fetch_listing_pages", fetch_listing_pages)
+    
+    # The feed is tried with the pooled session; its failure does not fall back to the HTML listing
+    assert news_bot.SOURCES["medias24.com"].collect(NOW) == []
+    assert [page for _, _, page in fetched] == [news_bot.FEED_PAGE]
+
+
+@pytest.mark.parametrize("answer", [
+    [{"id": 1, "title": "A", "summary": "Résumé A", "merged_ids": [2, 3]}, {"id": 2, "title": "B", "summary": "Résumé B"}],
+    [{"id": 2, "title": "B", "summary": "Résumé B"}, {"id": 1, "title": "A", "summary": "Résumé A", "merged_ids": [2, 3]}],
+])
+def test_parse_gemini_summaries_keeps_standalone_summaries(answer):
+    articles = [{'title': t, 'source': "BourseNews", 'link': f"https://example.ma/{t}"} for t in "ABC"]
+    entries = news_bot.parse_gemini_summaries(json.dumps(answer), articles)
+    assert entries[0]['merged_sources'] == [{'source': "BourseNews", 'link': "https://example.ma/C"}]
+    assert entries[1]['summary'] == "Résumé B."
+    assert entries[2] == {'merged_into': 1}
+
+
+def test_scraper_adapters_leave_challenge_responses_to_cloudscraper():
+    session = news_bot.requests.Session()
+    news_bot._tune_scraper_adapters(session)
+    for adapter in session.adapters.values():
+        assert 503 not in adapter.max_retries.status_forcelist
+        assert 502 in adapter.max_retries.status_forcelist
@@ -0,0 +1,218 @@
+"""Behavior tests of the stateful parts (seen store, HTTP cache, summary cache, pending digest,
+subscriptions, archive), each against a fresh STATE_DB_PATH.
+
+Run from the repository root:
+
+    python -m pytest -q tests
+"""
+import sqlite3
+import time
+from datetime import datetime
+
+import pytest
+import requests
+
+import news_bot
+
+
+def article(title, link, level=1, tickers=(), keywords=(), published=None):
+    return {'title': title, 'link': link, 'source': "BourseNews", 'importance': {'level': level},
+            'tickers': list(tickers), 'keywords': list(keywords), 'published': published}
+
+
+def response(status, body=b"", headers=None):
+    fake = requests.Response()
+    fake.status_code = status
+    fake._content = body
+    fake.headers.update(headers or {})
+    return fake
+
+
+@pytest.fixture
+def listing(monkeypatch):
+    """A source whose GETs are answered by the responses queued in listing.replies"""
+    monkeypatch.setattr(news_bot, "HTTP_CACHE_ENABLED", True)
+    source = news_bot.Source(name="Test", host="example.ma", listing_urls=["https://example.ma/actus"],
+                             extractor=None)
+    source.replies, source.requests = [], []
+
+    def get(url, headers):
+        source.requests.append(headers)
+        return source.replies.pop(0)
+    source.get = get
+    return source
+
+
+def fetch_and_commit(source):
+    result = news_bot.fetch_listing_page(source, source.listing_urls[0], 1)
+    if result['cache_entry']:
+        news_bot._pending_http_cache.append(result['cache_entry'])
+    news_bot.commit_http_cache()
+    return result
+
+
+def test_seen_articles_by_url(state_db):
+    news_bot.mark_articles_seen([article("Maroc Telecom : dividende", "https://www.example.ma/iam/?utm_source=x")])
+    seen = news_bot.load_seen_articles()
+    assert news_bot.is_article_seen(seen, "https://example.ma/iam", "Autre titre")
+    assert not news_bot.is_article_seen(seen, "https://example.ma/autre", "Autre titre")
+
+
+def test_seen_articles_by_title_only_the_same_day(state_db):
+    news_bot.mark_articles_seen([article("Le MASI ouvre en hausse", "https://example.ma/masi-1")])
+    seen = news_bot.load_seen_articles()
+    assert news_bot.is_article_seen(seen, "https://example.ma/masi-1-bis", "Le  masi ouvre en HAUSSE")
+    
+    # The daily wrap comes back under the same headline and a new URL every day
+    state_db.execute("UPDATE seen_articles SET seen_at = seen_at - 86400")
+    state_db.commit()
+    seen = news_bot.load_seen_articles()
+    assert not news_bot.is_article_seen(seen, "https://example.ma/masi-2", "Le MASI ouvre en hausse")
+    assert news_bot.is_article_seen(seen, "https://example.ma/masi-1", "Le MASI ouvre en hausse")
+
+
+def test_conditional_get_sends_validators(state_db, listing):
+    listing.replies = [response(200, b"<html>v1</html>", {'ETag': '"v1"', 'Last-Modified': "Wed, 05 Mar 2025 08:00:00 GMT"}),
+                       response(304)]
+    assert not fetch_and_commit(listing)['not_modified']
+    result = fetch_and_commit(listing)
+    assert result['not_modified']
+    assert listing.requests[1]['If-None-Match'] == '"v1"'
+    assert listing.requests[1]['If-Modified-Since'] == "Wed, 05 Mar 2025 08:00:00 GMT"
+
+
+def test_unchanged_body_skipped_without_validators(state_db, listing):
+    listing.replies = [response(200, b"<html>v1</html>"), response(200, b"<html>v1</html>"),
+                       response(200, b"<html>v2</html>")]
+    assert not fetch_and_commit(listing)['not_modified']
+    assert fetch_and_commit(listing)['not_modified']
+    assert not fetch_and_commit(listing)['not_modified']
+
+
+def test_validators_wait_for_commit(state_db, listing):
+    listing.replies = [response(200, b"<html>v1</html>", {'ETag': '"v1"'}), response(200, b"<html>v1</html>")]
+    news_bot.fetch_listing_page(listing, listing.listing_urls[0], 1)
+    # Not delivered, not committed: the next run fetches and parses the page again
+    assert not news_bot.fetch_listing_page(listing, listing.listing_urls[0], 1)['not_modified']
+    assert 'If-None-Match' not in listing.requests[1]
+
+
+def test_summary_cache(state_db, monkeypatch):
+    calls = []
+
+    def summarize_in_chunks(articles, api_key=None):
+        calls.append([a['title'] for a in articles])
+        return [{'title': a['title'], 'summary': "ملخص.", 'importance': 1} for a in articles]
+    monkeypatch.setattr(news_bot, "summarize_in_chunks", summarize_in_chunks)
+    articles = [article("Attijariwafa bank : dividende record", "https://example.ma/1", tickers=["ATW"]),
+                article("Maroc Telecom : suspension de cotation", "https://example.ma/2", tickers=["IAM"])]
+    
+    summaries, model_failed = news_bot.summarize_articles(articles)
+    assert not model_failed and len(summaries) == 2
+    assert news_bot.summarize_articles(articles)[0] == summaries
+    assert calls == [[a['title'] for a in articles]]
+    
+    # A changed text is a new cache key
+    articles[1]['full_text'] = "Reprise de la cotation"
+    news_bot.summarize_articles(articles)
+    assert calls[1] == [articles[1]['title']]
+
+
+def test_summary_cache_covers_merged_articles(state_db, monkeypatch):
+    calls = []
+
+    def summarize_in_chunks(articles, api_key=None):
+        calls.append(len(articles))
+        return [
+            {'title': "Attijariwafa", 'summary': "ملخص.", 'importance': 2,
+             'merged_sources': [{'source': "BourseNews", 'link': articles[1]['link']}]},
+            {'merged_into': 1},
+        ]
+    monkeypatch.setattr(news_bot, "summarize_in_chunks", summarize_in_chunks)
+    articles = [article("Attijariwafa bank : dividende record", "https://example.ma/1", tickers=["ATW"]),
+                article("Conseil d'administration : proposition de distribution", "https://example.ma/2")]
+    
+    for _ in range(2):
+        summaries, _ = news_bot.summarize_articles(articles)
+        assert [representative['link'] for _, representative in summaries] == ["https://example.ma/1"]
+    # The merged article is covered by the cached summary, the model is not asked again
+    assert calls == [2]
+
+
+def test_pending_digest_survives_restart(state_db):
+    pending = [article("Attijariwafa bank : dividende", "https://www.example.ma/1/", published=datetime(2025, 3, 5, 9)),
+               article("Label Vie : résultats", "https://example.ma/2")]
+    news_bot.queue_pending_articles(pending)
+    
+    state_db.close()
+    news_bot._state_db = None  # A new daemon process opens the database again
+    reloaded = news_bot.load_pending_articles()
+    assert reloaded == {"https://example.ma/1": pending[0], "https://example.ma/2": pending[1]}
+    
+    news_bot.clear_pending_articles()
+    assert news_bot.load_pending_articles() == {}
+
+
+def test_archive_search_and_daily_counts(state_db):
+    articles = [
+        article("Attijariwafa bank : dividende record", "https://example.ma/1", level=2, tickers=["ATW"],
+                published=datetime(2025, 3, 4, 9)),
+        article("Maroc Telecom : suspension de cotation", "https://example.ma/2", level=3, tickers=["IAM"],
+                published=datetime(2025, 3, 5, 9)),
+        article("Le MASI termine en hausse", "https://example.ma/3", published=datetime(2025, 3, 5, 16)),
+    ]
+    summaries = [({'title': "التجاري وفا بنك", 'summary': "توزيع أرباح قياسي."}, articles[0])]
+    news_bot.archive_articles(articles, summaries)
+    news_bot.archive_articles(articles[:1])  # Archived again: updated, not counted twice
+    
+    assert [a['link'] for a in news_bot.search_archive("dividende")] == ["https://example.ma/1"]
+    assert news_bot.search_archive("dividende")[0]['summary'] == "التجاري وفا بنك - توزيع أرباح قياسي."
+    assert [a['link'] for a in news_bot.search_archive(ticker="iam")] == ["https://example.ma/2"]
+    assert [a['link'] for a in news_bot.search_archive(since="2025-03-05")] == ["https://example.ma/3",
+                                                                                 "https://example.ma/2"]
+    assert news_bot.archive_daily_counts() == {"2025-03-04": {2: 1}, "2025-03-05": {3: 1, 1: 1}}
+    assert news_bot.archive_daily_counts("ATW") == {"2025-03-04": {2: 1}}
+
+
+def test_route_to_subscribers(state_db):
+    news_bot.add_subscription("10", "ATW")
+    news_bot.add_subscription("20", "all", min_importance=3)
+    articles = [
+        article("Attijariwafa bank : dividende", "https://example.ma/1", tickers=["ATW"]),
+        article("Suspension de cotation", "https://example.ma/2", level=3),
+    ]
+    assert news_bot.route_to_subscribers(articles) == {"10": [0], "20": [1]}
+    news_bot.remove_subscriptions("10")
+    assert news_bot.route_to_subscribers(articles) == {"20": [1]}
+
+
+def test_route_to_subscribers_sees_other_process_changes(state_db):
+    articles = [article("Attijariwafa bank : dividende", "https://example.ma/1", tickers=["ATW"])]
+    assert news_bot.route_to_subscribers(articles) == {}
+    
+    # The subscribe CLI runs in another process, with its own connection
+    other = sqlite3.connect(news_bot.STATE_DB_PATH)
+    other.execute(
+        "INSERT INTO subscriptions (chat_id, kind, value, min_importance, created_at) VALUES (?, ?, ?, ?, ?)",
+        ("10", "ticker", "ATW", 1, time.time()),
+    )
+    other.commit()
+    assert news_bot.route_to_subscribers(articles) == {"10": [0]}
+    
+    other.execute("DELETE FROM subscriptions WHERE chat_id = '10'")
+    other.commit()
+    other.close()
+    assert news_bot.route_to_subscribers(articles) == {}
+
+
+def test_issuer_list_fills_isins(tmp_path, monkeypatch):
+    issuers = tmp_path / "issuers.csv"
+    issuers.write_text("Ticker;Libellé;ISIN\nATW;ATTIJARIWAFA BANK;MA0000012445\nIAM;MAROC TELECOM;MA0000011489\n",
+                       encoding="utf-8")
+    monkeypatch.setattr(news_bot, "ISSUER_LIST_PATH", str(issuers))
+    monkeypatch.setattr(news_bot, "_entity_index", None)
+    
+    _, _, tickers = news_bot.get_entity_index()
+    assert tickers["ATW"]["isin"] == "MA0000012445"
+    assert tickers["IAM"]["isin"] is None  # Wrong check digit
+    assert news_bot.resolve_subscription_topic("MA0000012445") == ("ticker", "ATW")